@@ -0,0 +1,146 @@
+import argparse, contextlib, io, itertools, json, os, platform, random, resource, sys, time, timeit
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from bloomfilter import BloomFilter, HASH_SEEDED, HASH_DOUBLE
+from travelers import SimulationConfig, Trips, DetectionStore, Counter, accuracy
+
+# Times the hot paths separately: the Bloom filter operations for several (BFLEN, NHASH) settings,
+# and trip generation and counting for several numbers of trips. Every case runs in a fresh process,
+# so that its peak RSS is its own. The results are written as JSON, and can be compared against a
+# stored baseline: a case that got slower (in ops/sec) or less accurate than allowed is reported,
+# and the exit status is then 1. Every rate is the best of several repeats that each run for at least
+# 0.2 seconds, so that one slow repeat is not reported as a regression.
+
+BASELINE = "benchmark-baseline.json"
+REPEAT   = 5 # Repeats of every case, of which the fastest counts
+
+def rate(fn, ops = 1, repeat = REPEAT):
+	# Operations per second of fn(), which does ops operations per call. fn is called as many times
+	# as it takes to run for at least 0.2 seconds (timeit's autorange), and the fastest of repeat
+	# such runs counts.
+	timer     = timeit.Timer(fn)
+	number, _ = timer.autorange()
+	return ops * number / max(min(timer.repeat(repeat, number)), 1e-9)
+
+def peakRSS():
+	# Peak resident set size of this process in kB
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def filterCase(size, hash_count, items, hashing):
+	# Benchmark the operations of one Bloom filter setting, filled with the given number of items
+	rng       = numpy.random.default_rng(1)
+	ids       = rng.choice(10000000, 2 * items, replace = False)
+	inserted  = ids[:items].tolist()
+	absent    = ids[items:].tolist()
+	bf        = BloomFilter(0, 0, size, hash_count, hashing)
+	other     = BloomFilter(0, 0, size, hash_count, hashing)
+	other.add_many(ids[items // 2:items + items // 2])
+
+	it = itertools.cycle(inserted)
+	results = {}
+	results["add"]      = {"ops_per_sec": rate(lambda: bf.add(next(it)))}
+	results["add_many"] = {"ops_per_sec": rate(lambda: bf.add_many(ids[:items]), items)}
+	results["check"]    = {"ops_per_sec": rate(lambda: bf.check(next(it)))}
+	results["check"]["accuracy"] = 1 - sum(bf.check(item) for item in absent) / len(absent) # 1 - false positive rate
+	results["intersection"] = {"ops_per_sec": rate(lambda: bf.intersection(other))}
+	results["union"]        = {"ops_per_sec": rate(lambda: bf.union(other))}
+	results["estimatedSize"] = {"ops_per_sec": rate(bf.estimatedSize),
+															"accuracy": accuracy(items, bf.estimatedSize())}
+	for result in results.values():
+		result["peak_rss_kb"] = peakRSS()
+	return {"{}[m={},k={},n={}]".format(name, size, hash_count, items): result for name, result in results.items()}
+
+def countingCase(numTrips, commuters, hashing, vectorized):
+	# Benchmark generating and counting numTrips trips (with returns if commuters is set)
+	config = SimulationConfig(NUM_TRIPS = numTrips, MAX_DETECTIONS = numTrips, HASHING = hashing,
+														PROB_RETURN = 0.5 if commuters else 0, SEED = 1, VECTORIZED = vectorized)
+	random.seed(config.SEED)
+	numpy.random.seed(config.SEED)
+	results = {}
+	with contextlib.redirect_stdout(io.StringIO()):
+		# The slow cases run for seconds, so that fewer repeats of them suffice
+		trips = Trips.generate(config)
+		results["generateTrips"] = {"ops_per_sec": rate(lambda: Trips.generate(config), numTrips, 3)}
+
+		def storeTrips():
+			store = DetectionStore(config)
+			store.store(trips)
+			return store
+		tripSet = storeTrips().tripSet
+		results["store"] = {"ops_per_sec": rate(storeTrips, numTrips, 3)}
+
+		# Every repeat counts with a fresh Counter, whose query engine has empty caches
+		if commuters:
+			count, name, expected = Counter.findAllCommuters, "findAllCommuters", trips.numOfReturners
+		else:
+			count, name, expected = Counter.findAllSingleTrips, "findAllSingleTrips", numTrips
+		commuterSet, estSizeMid, estSizeFine = count(Counter(config, tripSet))
+		results[name] = {"ops_per_sec": rate(lambda: count(Counter(config, tripSet)), len(config.departureEpochs()), 3),
+										 "accuracy": accuracy(max(expected, 1), commuterSet.estimatedSize())}
+	for result in results.values():
+		result["peak_rss_kb"] = peakRSS()
+	return {"{}[trips={}]".format(name, numTrips): result for name, result in results.items()}
+
+def compare(results, baseline, tolerance):
+	# Return a line for every case that is slower or less accurate than in the baseline
+	regressions = []
+	for name, result in sorted(results.items()):
+		if name not in baseline:
+			continue
+		base = baseline[name]
+		if result["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+			regressions.append("{}: {:.4g} ops/sec, baseline {:.4g}".format(name, result["ops_per_sec"], base["ops_per_sec"]))
+		if "accuracy" in base and result["accuracy"] < base["accuracy"] - 0.01:
+			regressions.append("{}: accuracy {:.4f}, baseline {:.4f}".format(name, result["accuracy"], base["accuracy"]))
+	return regressions
+
+def benchmark(trips, commuterTrips, bflens, nhashes, items, hashing = HASH_SEEDED, vectorized = False):
+	# Run all cases, each in a fresh process, and return their results by name
+	cases = [(filterCase, (m, k, items, hashing)) for m, k in itertools.product(bflens, nhashes)] + \
+					[(countingCase, (n, False, hashing, vectorized)) for n in trips] + \
+					[(countingCase, (n, True, hashing, vectorized)) for n in commuterTrips]
+	results = {}
+	for case, args in cases:
+		with ProcessPoolExecutor(max_workers = 1) as pool:
+			results.update(pool.submit(case, *args).result())
+		print(case.__name__, *args, file = sys.stderr)
+	return results
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Benchmark of Bloom filter operations and counting")
+	parser.add_argument("--trips", type = int, nargs = "*", default = [1000, 10000, 100000, 1000000], help = "NUM_TRIPS values for findAllSingleTrips")
+	parser.add_argument("--commuter-trips", type = int, nargs = "*", default = [1000, 10000], help = "NUM_TRIPS values for findAllCommuters")
+	parser.add_argument("--bflen", type = int, nargs = "*", default = [14378, 143776], help = "Bloom filter sizes (BFLEN)")
+	parser.add_argument("--nhash", type = int, nargs = "*", default = [10, 4], help = "Numbers of hash functions (NHASH)")
+	parser.add_argument("--items", type = int, default = 1000, help = "Items added to the filters of the BFLEN/NHASH cases")
+	parser.add_argument("--hashing", choices = [HASH_SEEDED, HASH_DOUBLE], default = HASH_SEEDED, help = "Hashing scheme")
+	parser.add_argument("--vectorized", action = "store_true", help = "Generate networks and trips with NumPy")
+	parser.add_argument("--output", help = "Write the JSON results to this file instead of stdout")
+	parser.add_argument("--baseline", default = BASELINE, help = "Baseline to compare against, if it exists")
+	parser.add_argument("--save-baseline", action = "store_true", help = "Store the results as the new baseline")
+	parser.add_argument("--tolerance", type = float, default = 0.2, help = "Allowed relative slowdown")
+	args = parser.parse_args()
+
+	results = benchmark(args.trips, args.commuter_trips, args.bflen, args.nhash, args.items, args.hashing, args.vectorized)
+	report  = {"python": platform.python_version(), "numpy": numpy.__version__, "machine": platform.machine(),
+						 "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+
+	regressions = []
+	if os.path.exists(args.baseline) and not args.save_baseline:
+		with open(args.baseline) as f:
+			regressions = compare(results, json.load(f)["results"], args.tolerance)
+		report["regressions"] = regressions
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent = 1)
+	else:
+		json.dump(report, sys.stdout, indent = 1)
+		print()
+	if args.save_baseline:
+		with open(args.baseline, "w") as f:
+			json.dump(report, f, indent = 1)
+
+	for regression in regressions:
+		print("REGRESSION", regression, file = sys.stderr)
+	sys.exit(1 if regressions else 0)
@@ -1,91 +1,26 @@
 import pandas as pd
 import numpy as np
-import math
-import mmh3
-from datetime import datetime
-from bitarray import bitarray
+import sys
+import time
+from bloomfilter import BloomFilter
 # from hashlip import sha256
 import warnings
 warnings.filterwarnings("ignore")
-BFLEN =14378
-NHASH=10
+BFLEN =14378 ### m, set to 0 to size the filters from (n, p)
+NHASH=10 ### k, set to 0 to size the filters from (n, p)
+WINDOW=9 ### number of check-out filters after each check-in filter to intersect with
 
 ################################
-##     Bloom Filter class     ##
+##     Bloom Filter sizing    ##
 ################################
-
-class BloomFilter ( object ):
-
-    '''
-        Class for Bloom filter, using murmur3 hash function
-    '''
-    def __init__(self, items_count, fp_prob):
-        
-        '''
-        items_count : int
-            Number of items expected to be stored in bloom filter
-        fp_prob : float
-            False Positive probability in decimal
-        '''
-        # False possible probability in decimal
-        self.fp_prob = fp_prob
-        # Size of bit array to use
-        self.size = self.get_size(items_count, fp_prob)
-        # number of hash functions to use
-        self.hash_count = self.get_hash_count(self.size, items_count)
-        # Bit array of given size
-        self.bit_array = bitarray(self.size)
-        # initialize all bits as 0
-        self.bit_array.setall(0)
-        
-        
-    def add(self, item):
-        '''
-        Add an item in the filter
-        '''
-        digests = []
-        for i in range(self.hash_count):
-            # create digest for given item.
-            # i work as seed to mmh3.hash() function
-            # With different seed, digest created is different
-            digest = mmh3.hash(item, i) % self.size
-            digests.append(digest)
-            # set the bit True in bit_array
-            self.bit_array[digest] = True
-        return self.bit_array
-
-    
-    def check(self, item):
-        '''
-        Check for existence of an item in filter
-        '''
-        for i in range(self.hash_count):
-            digest = mmh3.hash(item, i) % self.size
-            if self.bit_array[digest] == False:
-                return False
-        return True
-    
-    
-    def get_size(self, n, p):
-        ''' 
-        Return the size of bit array(m) to used using
-        following formula
-        '''
-        m = 14378
-        # m = int(-(n * math.log(p))/(math.log(2)**2))
-        # print(m)
-        return int(m)
-    
-    
-    def get_hash_count(self, m, n):
-        '''
-        Return the hash function(k) to be used using
-        following formula
-        '''
-        k = 10
-        # k = int((m/n) * math.log(2))
-        # print(k)
-        return int(k)
+'''
+A Bloom filter from the shared core in bloomfilter.py: with (m, k) fixed to BFLEN and NHASH
+when both are set, otherwise sized for n identifiers at false positive probability p
+'''
+def new_filter(n=1000, p=0.001):
+    if BFLEN and NHASH:
+        return BloomFilter(fixed_size=BFLEN, fixed_hash_count=NHASH)
+    return BloomFilter(n, p)
 
 ###################################################
 ########           Helper Methods         #########
@@ -150,28 +85,60 @@ def get_time_frames(time_window = 120):
 ########           Epochs length         #########
 ###################################################
 
+'''
+Index of the time frame (of get_time_frames) that each time, in minutes since midnight, falls
+in, or -1 if it falls outside all time frames
+'''
+def minutes_index(minutes, time_window=60):
+    timeframes = get_time_frames(time_window)
+    timestamps = [tf[0] for tf in timeframes] + [timeframes[-1][1]]
+    bounds = np.array([(t // 100) * 60 + t % 100 for t in timestamps])
+    minutes = np.asarray(minutes, dtype=np.int64)
+    index = np.searchsorted(bounds, minutes, side="right") - 1
+    index[(minutes < bounds[0]) | (minutes >= bounds[-1])] = -1
+    return index
+
+'''
+The same for HHMM times
+'''
+def epoch_index(hhmm, time_window=60):
+    hhmm = np.asarray(hhmm, dtype=np.int64)
+    return minutes_index((hhmm // 100) * 60 + hhmm % 100, time_window)
+
+'''
+Bucketing the rows by (station, epoch) in a single pass: the epoch of every row follows from
+its time, and one stable sort on (epoch, station) puts the rows of each bucket next to each other
+
+returns:
+        the row order, the (epochs x stations) arrays with the start and stop of each bucket in
+        that order, and the stations (sorted)
+'''
+def bucket_index(df, time_col_name="check_in", station_name_col="in_p_gis", time_window=60):
+    times = df[time_col_name]
+    if pd.api.types.is_datetime64_any_dtype(times):
+        epochs = minutes_index(times.dt.hour.to_numpy() * 60 + times.dt.minute.to_numpy(), time_window)
+    else:
+        epochs = epoch_index(times.to_numpy(), time_window)
+    stations, station_codes = np.unique(df[station_name_col].to_numpy(), return_inverse=True)
+    n_epochs = len(get_time_frames(time_window))
+
+    keep = np.flatnonzero(epochs >= 0)
+    keys = epochs[keep] * len(stations) + station_codes.ravel()[keep]
+    order = keep[np.argsort(keys, kind="stable")]
+    bounds = np.searchsorted(np.sort(keys), np.arange(n_epochs * len(stations) + 1))
+    starts = bounds[:-1].reshape(n_epochs, len(stations))
+    stops = bounds[1:].reshape(n_epochs, len(stations))
+    return order, starts, stops, stations
+
 '''
 Extracting trips during epochs for each station
 '''
 def divide_with_time_window(df, time_col_name="check_in", station_name_col="in_p_gis", time_window=60):
-    temp_timeframes = get_time_frames(time_window)
-    timeframes = []
-    for tf in temp_timeframes:
-        tf0 = datetime.strptime(str(tf[0]),"%H%M")
-        tf1 = datetime.strptime(str(tf[1]),"%H%M")
-        timeframes.append((tf0, tf1))
-    
+    order, starts, stops, stations = bucket_index(df, time_col_name, station_name_col, time_window)
     output_dfs = []  ##### contains several dataframes of time windows
-    for time_frame in timeframes:
-        stations = set(list(df[station_name_col]))
-
-        for station in stations:
-            output_df = pd.DataFrame()
-            for index,row in df.iterrows():
-                ##### finding all trips for the every single station in a specific time frame to assign correction
-                if row[time_col_name] >= time_frame[0] and row[time_col_name] < time_frame[1] and row[station_name_col] == station:
-                    output_df = output_df.append(row)
-            output_dfs.append(output_df)
+    for epoch in range(len(starts)):
+        for station in range(len(stations)):
+            output_dfs.append(df.iloc[order[starts[epoch, station]:stops[epoch, station]]])
     '''
     the output is a list of epochs dataframe for each station, which later Bloom filter will be applied on each of them
     '''
@@ -185,58 +152,117 @@ def bloom_filter(dfs):
         if len(df)>0:
             n = 1000### number of identifiers during each epoch
             p = 0.001 ### false positive
-            bloomf_in = BloomFilter(n,p)
+            bloomf_in = new_filter(n,p)
             for bid in df["binary_ids"]:
                 bloomf_in.add(str(bid))
             bloomfilters_in.append(bloomf_in.bit_array)
         else:
-            bloomfilters_in.append(bitarray([0]*BFLEN))
+            bloomfilters_in.append(new_filter().bit_array)
     return(bloomfilters_in)
 
+###################################################
+########    Intersection and union        #########
+###################################################
+'''
+Intersecting every check-in filter with the next `window` check-out filters and OR-ing the
+intersections into one running union. All operations work on whole bitarrays, and no
+intersection is kept after it has been added to the union.
+
+returns:
+        the union of all intersections
+'''
+def union_of_intersections(bloomfilters_in, bloomfilters_out, window=WINDOW):
+    union_all = new_filter().bit_array
+    for i, dep_a in enumerate(bloomfilters_in):
+        for dep_b in bloomfilters_out[i+1:i+1+window]:
+            union_all |= dep_a & dep_b
+    return union_all
+
+###################################################
+########        Streaming ingestion       #########
+###################################################
+'''
+Reading check-in/check-out rows in chunks and inserting each card identifier straight into
+the Bloom filter of its (station, epoch), so that memory is bounded by the filter grid and
+not by the size of the input
+
+returns:
+        the check-in and check-out filters, in the order of bloom_filter(divide_with_time_window(...))
+        (stations sorted by name), the number of rows read and the rows per second
+'''
+def stream_bloom_filters(path, time_window=60, chunk_rows=100000, n=1000, p=0.001):
+    n_epochs = len(get_time_frames(time_window))
+    filters_in, filters_out = {}, {}    ##### (station, epoch) -> Bloom filter
+    stations_in, stations_out = set(), set()    ##### all stations, also those without rows inside the time frames, as in bucket_index
+    rows = 0
+    start = time.time()
+    columns = ["check_in", "check_out", "in_p_gis", "out_p_gis", "binary_ids"]
+    for chunk in pd.read_csv(path, sep=";", usecols=columns, chunksize=chunk_rows):
+        rows += len(chunk)
+        for time_col, station_col, filters, seen in (("check_in", "in_p_gis", filters_in, stations_in),
+                                                     ("check_out", "out_p_gis", filters_out, stations_out)):
+            seen.update(chunk[station_col].unique().tolist())
+            epochs = epoch_index(chunk[time_col].to_numpy(), time_window)
+            keep = epochs >= 0
+            stations = chunk[station_col].to_numpy()[keep]
+            for station, epoch, bid in zip(stations, epochs[keep], chunk["binary_ids"].to_numpy()[keep]):
+                bloomf = filters.get((station, epoch))
+                if bloomf is None:
+                    bloomf = filters[(station, epoch)] = new_filter(n, p)
+                bloomf.add(str(bid))
+    rate = rows / max(time.time() - start, 1e-9)
+
+    def flatten(filters, stations):
+        return [filters[(station, epoch)].bit_array if (station, epoch) in filters else new_filter(n, p).bit_array
+                for epoch in range(n_epochs) for station in sorted(stations)]
+
+    return flatten(filters_in, stations_in), flatten(filters_out, stations_out), rows, rate
+
 ###################################
 ##########    Main      ############
 ####################################
-from bfs import BloomFilter
-
 if __name__ == "__main__":
 
-    print(" Loading Data . . . ")
-    
-    smart_card_df = pd.read_csv('gt1000.csv',";")
-    smart_card_df["check_in"] = pd.to_datetime(smart_card_df["check_in"], format="%H%M")
-    smart_card_df["check_out"] = pd.to_datetime(smart_card_df["check_out"], format="%H%M")
-    ########################################
-    #####         Epoch length        ######
-    ########################################
-    print("Bloom filter is loading ----------------")
-    check_ins_dfs = divide_with_time_window(smart_card_df, time_col_name="check_in", station_name_col="in_p_gis",  time_window=5)##time window is epoch length
-    check_outs_dfs = divide_with_time_window(smart_card_df, time_col_name="check_out", station_name_col="out_p_gis", time_window=5)##time window is epoch length
-    
-    ########################################
-    #####     Calling Bloom Filters   ######
-    ########################################
-    
-    bloomfilters_in = bloom_filter(check_ins_dfs)
-    bloomfilters_out = bloom_filter(check_outs_dfs)
+    if "--stream" in sys.argv:
+        ########################################
+        #####   Streaming Bloom Filters   ######
+        ########################################
+        print("Bloom filter is streaming ----------------")
+        bloomfilters_in, bloomfilters_out, rows, rate = stream_bloom_filters('gt1000.csv', time_window=5)##time window is epoch length
+        print("Streamed {} rows ({:.0f} rows/sec)".format(rows, rate))
+    else:
+        print(" Loading Data . . . ")
+
+        smart_card_df = pd.read_csv('gt1000.csv', sep=";")
+        smart_card_df["check_in"] = pd.to_datetime(smart_card_df["check_in"], format="%H%M")
+        smart_card_df["check_out"] = pd.to_datetime(smart_card_df["check_out"], format="%H%M")
+        ########################################
+        #####         Epoch length        ######
+        ########################################
+        print("Bloom filter is loading ----------------")
+        check_ins_dfs = divide_with_time_window(smart_card_df, time_col_name="check_in", station_name_col="in_p_gis",  time_window=5)##time window is epoch length
+        check_outs_dfs = divide_with_time_window(smart_card_df, time_col_name="check_out", station_name_col="out_p_gis", time_window=5)##time window is epoch length
+
+        ########################################
+        #####     Calling Bloom Filters   ######
+        ########################################
+
+        bloomfilters_in = bloom_filter(check_ins_dfs)
+        bloomfilters_out = bloom_filter(check_outs_dfs)
     ########################################
     #####     Intersection operation  ######
     ########################################
-    inter_ab=[]
-    for i,dep_a in zip(range(len(bloomfilters_in)), bloomfilters_in):
-        dep_b_list = bloomfilters_out[i+1:i+10]
-        for dep_b in dep_b_list:          
-            multiply=[a & b for a,b in zip(dep_a,dep_b)]
-            inter_ab.append(multiply)
-            
-    union_all = inter_ab[0]
-    for i in range(1, len(inter_ab)):
-        union_all = [a | b for a, b in zip(union_all, inter_ab[i])]
-    tm = sum(union_all)   
+    window = int(sys.argv[sys.argv.index("--window") + 1]) if "--window" in sys.argv else WINDOW
+    union_all = union_of_intersections(bloomfilters_in, bloomfilters_out, window)
+    tm = union_all.count()
     ##########################################
     ########          accuracy      ########## 
     ##########################################
 
-    c=int(-(BFLEN/NHASH)*np.log(1- (tm/BFLEN)))
+    union_bf = new_filter()
+    union_bf.bit_array = union_all
+    print("Union:", union_bf.stats())
+    c=union_bf.estimatedSize()
     ct=1000
     accuracy = max(1 - (abs(c - ct) / ct), 0)
     print("Accuracy:",accuracy)
@@ -2,9 +2,177 @@
 # Install mmh3 and bitarray 3rd party module first
 # pip install mmh3
 # pip install bitarray
+# pip install numpy
 import math
 import mmh3
+import numpy
+import struct
+from collections import OrderedDict
 from bitarray import bitarray
+from bitarray.util import count_and
+
+HASH_SEEDED = 'seeded' # k murmur3 32-bit hashes of str(item), seeded 0..k-1 (reference mode)
+HASH_DOUBLE = 'double' # Kirsch-Mitzenmacher double hashing over one 128-bit murmur3 digest
+
+MASK64 = (1 << 64) - 1
+
+# On-disk format of a BloomFilterMatrix: a 64-byte header followed by the packed bit matrix,
+# row by row, each row padded to a multiple of 8 bytes. The bits of a row are stored as in
+# a big-endian bitarray (bit i is bit 7 - i%8 of byte i/8). Both hashing schemes use fixed
+# seeds (HASH_SEEDED: the hash indices 0..k-1, HASH_DOUBLE: murmur128 with seed 0), so the seed
+# field is always GRID_SEED; a file with another seed could not be queried with these positions.
+GRID_MAGIC   = b'BFGRID\x00\x01'
+GRID_HEADER  = struct.Struct('<8sIIQIIIIIQ') # magic, version, hashing, m, k, seed, epoch length, locations, epochs, words
+GRID_OFFSET  = 64
+GRID_VERSION = 1
+GRID_SEED    = 0
+GRID_HASHING = [HASH_SEEDED, HASH_DOUBLE]
+
+# Constants of MurmurHash3_x64_128
+C1 = numpy.uint64(0x87c37b91114253d5)
+C2 = numpy.uint64(0x4cf5ad432745937f)
+F1 = numpy.uint64(0xff51afd7ed558ccd)
+F2 = numpy.uint64(0xc4ceb9fe1a85ec53)
+
+
+def fmix64(k):
+	'''
+	Finalization mix of MurmurHash3 on an array of uint64
+	'''
+	k = k ^ (k >> numpy.uint64(33))
+	k = k * F1
+	k = k ^ (k >> numpy.uint64(33))
+	k = k * F2
+	k = k ^ (k >> numpy.uint64(33))
+	return k
+
+def murmur128(ids):
+	'''
+	Vectorized MurmurHash3_x64_128 (seed 0) of 64-bit integer IDs, each hashed as
+	its 8-byte little-endian representation. Returns the low and high 64-bit halves
+	of the digest, identical to mmh3.hash128(key, signed=False).
+	'''
+	keys = numpy.asarray(ids, dtype=numpy.int64).astype('<i8').view(numpy.uint64)
+	k1 = keys * C1
+	k1 = (k1 << numpy.uint64(31)) | (k1 >> numpy.uint64(33))
+	k1 = k1 * C2
+	h1 = k1 ^ numpy.uint64(8) # seed 0, xor-ed with the key length
+	h2 = numpy.full_like(h1, 8)
+	h1 = h1 + h2
+	h2 = h2 + h1
+	h1 = fmix64(h1)
+	h2 = fmix64(h2)
+	h1 = h1 + h2
+	h2 = h2 + h1
+	return h1, h2
+
+def doubleHashPositions(ids, size, hash_count):
+	'''
+	Return an (n, hash_count) array with bit positions (h1 + i*h2) mod size for every ID
+	'''
+	h1, h2 = murmur128(ids)
+	return digestPositions(h1, h2, size, hash_count)
+
+def digestPositions(h1, h2, size, hash_count):
+	'''
+	Return an (n, hash_count) array with bit positions (h1 + i*h2) mod size for the halves
+	h1 and h2 of n digests
+	'''
+	i = numpy.arange(hash_count, dtype=numpy.uint64)
+	return ((h1[:, None] + i[None, :] * h2[:, None]) % numpy.uint64(size)).astype(numpy.int64)
+
+def popcount(words, axis=-1):
+	'''
+	Return the number of set bits in an array of uint64 words, summed along axis
+	'''
+	if hasattr(numpy, 'bitwise_count'):
+		return numpy.bitwise_count(words).sum(axis=axis, dtype=numpy.int64)
+	return numpy.unpackbits(words.view(numpy.uint8), axis=-1).sum(axis=axis, dtype=numpy.int64)
+
+def setBits(buf, positions):
+	'''
+	Set the bits at the given positions in a uint8 buffer, using the big-endian bit
+	order of bitarray (bit i is bit 7 - i%8 of byte i/8)
+	'''
+	positions = numpy.asarray(positions, dtype=numpy.int64).ravel()
+	numpy.bitwise_or.at(buf, positions >> 3, (128 >> (positions & 7)).astype(numpy.uint8))
+
+
+class HashedKey(object):
+
+	'''
+	An item hashed once, that can be added to or checked in any number of Bloom filters with
+	the same hashing scheme, whatever their size, without hashing it again
+	'''
+
+	def __init__(self, item, hashing=HASH_SEEDED, hash_count=1):
+		'''
+		hashing : str
+			HASH_SEEDED or HASH_DOUBLE, as the filters it will be used with
+		hash_count : int
+			Number of seeded hashes to compute in advance (HASH_SEEDED only, more are added on use)
+		'''
+		self.item = item
+		self.hashing = hashing
+		if hashing == HASH_DOUBLE:
+			digest = mmh3.hash128(int(item).to_bytes(8, 'little', signed=True), seed=0, signed=False)
+			self.h1, self.h2 = digest & MASK64, digest >> 64
+		else:
+			self.key = str(item)
+			self.hashes = [mmh3.hash(self.key, i) for i in range(hash_count)]
+
+	def positions(self, size, hash_count):
+		'''
+		Return the bit positions of the item in a filter of the given size and hash count
+		'''
+		if self.hashing == HASH_DOUBLE:
+			return [((self.h1 + i * self.h2) & MASK64) % size for i in range(hash_count)]
+		for i in range(len(self.hashes), hash_count):
+			self.hashes.append(mmh3.hash(self.key, i))
+		return [h % size for h in self.hashes[:hash_count]]
+
+class HashedKeys(object):
+
+	'''
+	A batch of integer IDs hashed once, for positions_many/add_many/check_many of any number of
+	Bloom filters with the same hashing scheme (see HashedKey)
+	'''
+
+	def __init__(self, ids, hashing=HASH_SEEDED, hash_count=1):
+		self.hashing = hashing
+		if hashing == HASH_DOUBLE:
+			self.h1, self.h2 = murmur128(ids)
+		else:
+			self.keys = [str(item) for item in ids]
+			self.hashes = numpy.array([[mmh3.hash(key, i) for i in range(hash_count)] for key in self.keys],
+																dtype=numpy.int64).reshape(-1, hash_count)
+
+	def __len__(self):
+		return len(self.h1) if self.hashing == HASH_DOUBLE else len(self.hashes)
+
+	def take(self, indices):
+		'''
+		Return the keys at the given indices (with repetitions, if any), without hashing again
+		'''
+		keys = HashedKeys.__new__(HashedKeys)
+		keys.hashing = self.hashing
+		if self.hashing == HASH_DOUBLE:
+			keys.h1, keys.h2 = self.h1[indices], self.h2[indices]
+		else:
+			keys.keys = [self.keys[i] for i in indices]
+			keys.hashes = self.hashes[indices]
+		return keys
+
+	def positions(self, size, hash_count):
+		'''
+		Return an (n, hash_count) array with the bit positions of all keys
+		'''
+		if self.hashing == HASH_DOUBLE:
+			return digestPositions(self.h1, self.h2, size, hash_count)
+		if self.hashes.shape[1] < hash_count:
+			extra = [[mmh3.hash(key, i) for i in range(self.hashes.shape[1], hash_count)] for key in self.keys]
+			self.hashes = numpy.hstack((self.hashes, numpy.array(extra, dtype=numpy.int64).reshape(len(self.keys), -1)))
+		return self.hashes[:, :hash_count] % size
 
 
 class BloomFilter(object):
@@ -13,13 +181,21 @@ class BloomFilter(object):
 	Class for Bloom filter, using murmur3 hash function
 	'''
 
-	def __init__(self, items_count=0, fp_prob=0, fixed_size=0, fixed_hash_count=0):
+	def __init__(self, items_count=0, fp_prob=0, fixed_size=0, fixed_hash_count=0, hashing=HASH_SEEDED, track_fill=False):
 		'''
 		items_count : int
 			Number of items expected to be stored in bloom filter
 		fp_prob : float
 			False Positive probability in decimal
+		hashing : str
+			HASH_SEEDED (reference) or HASH_DOUBLE (single digest, vectorized)
+		track_fill : bool
+			Keep a running count of the set bits, so that estimatedSize() needs no popcount
 		'''
+		assert(hashing in (HASH_SEEDED, HASH_DOUBLE))
+		self.hashing = hashing
+		self.track_fill = track_fill
+
 		if items_count == 0:
 			assert(fixed_size > 0)
 			assert(fixed_hash_count > 0)
@@ -36,33 +212,69 @@ class BloomFilter(object):
 			self.hash_count = self.get_hash_count(self.size, items_count)
 
 		# Bit array of given size
-		self.bit_array = bitarray(self.size)
+		self.bit_array = bitarray(self.size, endian='big')
 
 		# initialize all bits as 0
 		self.bit_array.setall(0)
 
+		# Number of set bits, maintained only when track_fill is on
+		self.fill = 0 if track_fill else None
+
+	def positions(self, item):
+		'''
+		Return the bit positions of an item (or HashedKey)
+		'''
+		if isinstance(item, HashedKey):
+			assert(item.hashing == self.hashing)
+			return item.positions(self.size, self.hash_count)
+		if self.hashing == HASH_DOUBLE:
+			digest = mmh3.hash128(int(item).to_bytes(8, 'little', signed=True), seed=0, signed=False)
+			h1, h2 = digest & MASK64, digest >> 64
+			return [((h1 + i * h2) & MASK64) % self.size for i in range(self.hash_count)]
+
+		# i work as seed to mmh3.hash() function
+		# With different seed, digest created is different
+		return [mmh3.hash(str(item), i) % self.size for i in range(self.hash_count)]
+
+	def positions_many(self, ids):
+		'''
+		Return an (n, hash_count) array with the bit positions of all items (or HashedKeys)
+		'''
+		if isinstance(ids, HashedKeys):
+			assert(ids.hashing == self.hashing)
+			return ids.positions(self.size, self.hash_count)
+		if self.hashing == HASH_DOUBLE:
+			return doubleHashPositions(ids, self.size, self.hash_count)
+		return numpy.array([self.positions(item) for item in ids], dtype=numpy.int64).reshape(-1, self.hash_count)
+
 	def add(self, item):
 		'''
 		Add an item in the filter
 		'''
-		digests = []
-		for i in range(self.hash_count):
-
-			# create digest for given item.
-			# i work as seed to mmh3.hash() function
-			# With different seed, digest created is different
-			digest = mmh3.hash(str(item), i) % self.size
-			digests.append(digest)
+		for digest in self.positions(item):
+			if self.track_fill and not self.bit_array[digest]:
+				self.fill = self.fill + 1
 
 			# set the bit True in bit_array
 			self.bit_array[digest] = True
 
+	def add_many(self, ids):
+		'''
+		Add a batch of items in the filter. Sets the same bits as calling add()
+		for every item.
+		'''
+		positions = self.positions_many(ids).ravel()
+		buf = numpy.frombuffer(self.bit_array, dtype=numpy.uint8)
+		if self.track_fill:
+			positions = numpy.unique(positions)
+			self.fill = self.fill + int(((buf[positions >> 3] >> (7 - (positions & 7))) & 1 == 0).sum())
+		setBits(buf, positions)
+
 	def check(self, item):
 		'''
 		Check for existence of an item in filter
 		'''
-		for i in range(self.hash_count):
-			digest = mmh3.hash(str(item), i) % self.size
+		for digest in self.positions(item):
 			if self.bit_array[digest] == False:
 
 				# if any of bit is False then,its not present
@@ -71,25 +283,75 @@ class BloomFilter(object):
 				return False
 		return True
 
+	def check_many(self, ids):
+		'''
+		Check for existence of a batch of items, returning a boolean array
+		'''
+		positions = self.positions_many(ids)
+		buf = numpy.frombuffer(self.bit_array, dtype=numpy.uint8)
+		bits = (buf[positions >> 3] >> (7 - (positions & 7))) & 1
+		return bits.all(axis=1)
+
+	def numOnes(self):
+		'''
+		Return the number of bits set in this BF
+		'''
+		if self.track_fill:
+			return self.fill
+		return self.bit_array.count()
+
+	def stats(self):
+		'''
+		Return the size, number of hash functions, number of set bits and fill ratio of this BF
+		'''
+		t = self.numOnes()
+		return {"size": self.size, "hash_count": self.hash_count, "set_bits": t, "fill_ratio": t / self.size}
+
+	def ls(self):
+		'''
+		Return [size, hash count, set bits, fill ratio] of this BF
+		'''
+		stats = self.stats()
+		return [stats["size"], stats["hash_count"], stats["set_bits"], stats["fill_ratio"]]
+
+	def buffer(self):
+		'''
+		Return a writable memoryview of the packed bits (1 bit per position, big-endian bit order)
+		'''
+		return memoryview(self.bit_array)
+
 	def estimatedSize(self):
 		'''
 		Estimate the size of the set represented by this BF
 		'''
-		t = 0
-		for i in range(1,self.size):
-			if self.bit_array[i] == True:
-				t = t + 1
-#		print(t, self.size, self.hash_count)
+		return self.sizeFromOnes(self.numOnes())
+
+	def estimatedIntersectionSize(self, bf):
+		'''
+		Estimate the size of the intersection with another BF, without building it.
+		Equal to self.intersection(bf).estimatedSize().
+		'''
+		assert(self.size == bf.size and self.hashing == bf.hashing)
+		return self.sizeFromOnes(count_and(self.bit_array, bf.bit_array))
+
+	def sizeFromOnes(self, t):
+		'''
+		Estimate the number of items in a BF of this size with t bits set. A full filter
+		is estimated as if one bit were still clear, the largest estimate it can give.
+		'''
+		t = min(t, self.size - 1)
 		return int(-1 * (self.size / self.hash_count) * math.log(1 - t/self.size))
 
 	def intersection(self, bf):
 		'''
 		Return the intersection of two Bloom filters
 		'''
-		assert(self.size == bf.size)
-		intersectionBF = BloomFilter(0,0,self.size, self.hash_count)
+		assert(self.size == bf.size and self.hashing == bf.hashing)
+		intersectionBF = BloomFilter(0,0,self.size, self.hash_count, self.hashing, self.track_fill)
 
 		intersectionBF.bit_array = self.bit_array & bf.bit_array
+		if intersectionBF.track_fill:
+			intersectionBF.fill = intersectionBF.bit_array.count()
 
 		# for i in range(self.size):
 		# 	if self.bit_array[i] and bf.bit_array[i]:
@@ -101,10 +363,12 @@ class BloomFilter(object):
 		'''
 		Return the union of two Bloom filters
 		'''
-		assert(self.size == bf.size)
-		unionBF = BloomFilter(0,0,self.size, self.hash_count)
+		assert(self.size == bf.size and self.hashing == bf.hashing)
+		unionBF = BloomFilter(0,0,self.size, self.hash_count, self.hashing, self.track_fill)
 
 		unionBF.bit_array = self.bit_array | bf.bit_array
+		if unionBF.track_fill:
+			unionBF.fill = unionBF.bit_array.count()
 		
 		# for i in range(self.size):
 		# 	if self.bit_array[i] or bf.bit_array[i]:
@@ -112,6 +376,28 @@ class BloomFilter(object):
 
 		return unionBF
 				
+	def words(self):
+		'''
+		Return a copy of the bit array as uint64 words, zero padded to a multiple of 64 bits
+		'''
+		words = numpy.zeros((self.size + 63) // 64, dtype=numpy.uint64)
+		data = self.bit_array.tobytes()
+		words.view(numpy.uint8)[:len(data)] = numpy.frombuffer(data, dtype=numpy.uint8)
+		return words
+
+	@classmethod
+	def fromWords(cls, words, size, hash_count, hashing=HASH_SEEDED, track_fill=False):
+		'''
+		Return a Bloom filter holding a copy of the given uint64 words (see words())
+		'''
+		bf = cls(0, 0, size, hash_count, hashing, track_fill)
+		bf.bit_array = bitarray(endian='big')
+		bf.bit_array.frombytes(numpy.ascontiguousarray(words).tobytes())
+		del bf.bit_array[size:]
+		if track_fill:
+			bf.fill = bf.bit_array.count()
+		return bf
+
 	@classmethod
 	def get_size(self, n, p):
 		'''
@@ -149,12 +435,214 @@ class BloomFilter(object):
 		fp = (1 - e^(-kn/m))^k
 
 		k : int
-      number of hash functions
+			number of hash functions
 		m : int
 			size of bit array
 		n : int
 			number of items expected to be stored in filter
 		'''
-		fp = pow((1 - math.exp(-k * m / n)), k)
+		fp = pow((1 - math.exp(-k * n / m)), k)
 		return fp
-	
+
+
+class BloomFilterMatrix(object):
+
+	'''
+	Grid of equally sized Bloom filters, one per (location, epoch), packed row-major
+	into a single contiguous 2-D uint64 array of shape (locations * epochs, words)
+	'''
+
+	def __init__(self, locations, epochs, items_count=0, fp_prob=0, fixed_size=0, fixed_hash_count=0, hashing=HASH_SEEDED):
+		'''
+		locations : int
+			Number of locations (outer axis of the grid)
+		epochs : int
+			Number of epochs per location (inner axis of the grid)
+		The remaining arguments size the filters as in BloomFilter
+		'''
+		self.template = BloomFilter(items_count, fp_prob, fixed_size, fixed_hash_count, hashing)
+		self.size = self.template.size
+		self.hash_count = self.template.hash_count
+		self.hashing = hashing
+		self.locations = locations
+		self.epochs = epochs
+		self.nwords = (self.size + 63) // 64
+
+		# The bit matrix is only allocated on first use
+		self._bits = None
+
+		# Epoch length in minutes, only recorded in saved files
+		self.epoch_length = 0
+
+	@property
+	def bits(self):
+		'''
+		The (locations * epochs, words) matrix with all filters
+		'''
+		if self._bits is None:
+			self._bits = numpy.zeros((self.locations * self.epochs, self.nwords), dtype=numpy.uint64)
+		return self._bits
+
+	def grid(self):
+		'''
+		Return a (locations, epochs, words) view of all filters
+		'''
+		return self.bits.reshape(self.locations, self.epochs, self.nwords)
+
+	def row(self, location, epoch):
+		'''
+		Return a view of the words of the filter for (location, epoch)
+		'''
+		return self.bits[location * self.epochs + epoch]
+
+	def add(self, location, epoch, item):
+		'''
+		Add an item to the filter for (location, epoch)
+		'''
+		self.add_many(location, epoch, [item])
+
+	def add_many(self, location, epoch, ids):
+		'''
+		Add a batch of items to the filter for (location, epoch)
+		'''
+		setBits(self.row(location, epoch).view(numpy.uint8), self.template.positions_many(ids))
+
+	def add_rows(self, rows, ids):
+		'''
+		Add every item ids[i] to the filter in row rows[i] (row = location * epochs + epoch)
+		'''
+		positions = self.template.positions_many(ids)
+		rows = numpy.asarray(rows, dtype=numpy.int64).reshape(-1, 1)
+		buf = self.bits.view(numpy.uint8).ravel()
+		setBits(buf, rows * (self.nwords * 64) + positions)
+
+	def check_many(self, location, epoch, ids):
+		'''
+		Check for existence of a batch of items in the filter for (location, epoch)
+		'''
+		positions = self.template.positions_many(ids)
+		buf = self.row(location, epoch).view(numpy.uint8)
+		bits = (buf[positions >> 3] >> (7 - (positions & 7))) & 1
+		return bits.all(axis=1)
+
+	def union_rows(self, start, stop):
+		'''
+		Return the words of the union of the filters in rows [start, stop)
+		'''
+		return numpy.bitwise_or.reduce(self.bits[start:stop], axis=0)
+
+	def intersect_rows(self, start, stop):
+		'''
+		Return the words of the intersection of the filters in rows [start, stop)
+		'''
+		return numpy.bitwise_and.reduce(self.bits[start:stop], axis=0)
+
+	def popcount_rows(self, start=0, stop=None):
+		'''
+		Return the number of set bits of every filter in rows [start, stop)
+		'''
+		return popcount(self.bits[start:stop])
+
+	def aggregate(self):
+		'''
+		Return an (epochs, words) array with, per epoch, the union of the filters of all
+		locations
+		'''
+		return numpy.bitwise_or.reduce(self.grid(), axis=0)
+
+	def toFilter(self, words):
+		'''
+		Return a BloomFilter holding a copy of a row of words
+		'''
+		return BloomFilter.fromWords(words, self.size, self.hash_count, self.hashing)
+
+	def filter(self, location, epoch):
+		'''
+		Return a BloomFilter holding a copy of the filter for (location, epoch)
+		'''
+		return self.toFilter(self.row(location, epoch))
+
+	def save(self, fileName):
+		'''
+		Write the header and the packed bit matrix to fileName
+		'''
+		header = GRID_HEADER.pack(GRID_MAGIC, GRID_VERSION, GRID_HASHING.index(self.hashing), self.size,
+															self.hash_count, GRID_SEED, self.epoch_length, self.locations, self.epochs, self.nwords)
+		with open(fileName, 'wb') as f:
+			f.write(header.ljust(GRID_OFFSET, b'\x00'))
+			self.bits.tofile(f)
+
+	@classmethod
+	def load(cls, fileName, mode='r'):
+		'''
+		Open a matrix written by save(). The bits are memory-mapped, not read: opening takes
+		constant time, and only the pages that are used are brought into memory.
+
+		mode : str
+			'r' (read-only), 'r+' (write back to the file) or 'c' (copy-on-write)
+		'''
+		with open(fileName, 'rb') as f:
+			header = GRID_HEADER.unpack(f.read(GRID_HEADER.size))
+		magic, version, hashing, size, hash_count, seed, epoch_length, locations, epochs, nwords = header
+		assert(magic == GRID_MAGIC and version == GRID_VERSION and seed == GRID_SEED)
+		matrix = cls(locations, epochs, fixed_size=size, fixed_hash_count=hash_count, hashing=GRID_HASHING[hashing])
+		assert(matrix.nwords == nwords)
+		matrix.epoch_length = epoch_length
+		matrix._bits = numpy.memmap(fileName, dtype=numpy.uint64, mode=mode, offset=GRID_OFFSET,
+																shape=(locations * epochs, nwords))
+		return matrix
+
+
+class FilterRows(object):
+
+	'''
+	Read-only sequence of Bloom filters over the rows of a uint64 word matrix, for
+	example one in shared memory. A row is copied into a BloomFilter on first access.
+	'''
+
+	def __init__(self, words, size, hash_count, hashing=HASH_SEEDED):
+		self.words = words
+		self.size = size
+		self.hash_count = hash_count
+		self.hashing = hashing
+		self.filters = {}
+
+	def __len__(self):
+		return len(self.words)
+
+	def __getitem__(self, row):
+		bf = self.filters.get(row)
+		if bf is None:
+			bf = BloomFilter.fromWords(self.words[row], self.size, self.hash_count, self.hashing)
+			self.filters[row] = bf
+		return bf
+
+
+class EpochUnions(object):
+
+	'''
+	Read-only sequence of Bloom filters with, per epoch, the union of the filters of all
+	locations of a BloomFilterMatrix, for example a memory-mapped one. An epoch is
+	aggregated when it is read, and only the cache_size most recently read epochs are kept.
+	'''
+
+	def __init__(self, matrix, cache_size=64):
+		self.matrix = matrix
+		self.cache_size = cache_size
+		self.filters = OrderedDict()
+
+	def __len__(self):
+		return self.matrix.epochs
+
+	def __getitem__(self, epoch):
+		if not 0 <= epoch < self.matrix.epochs:
+			raise IndexError(epoch)
+		bf = self.filters.get(epoch)
+		if bf is None:
+			bf = self.matrix.toFilter(numpy.bitwise_or.reduce(self.matrix.grid()[:, epoch], axis=0))
+			self.filters[epoch] = bf
+			if len(self.filters) > self.cache_size:
+				self.filters.popitem(last=False)
+		else:
+			self.filters.move_to_end(epoch)
+		return bf
@@ -0,0 +1,314 @@
+import argparse, asyncio, contextlib, io, os, tempfile, types
+import mmh3
+import numpy
+from bloomfilter import BloomFilter, BloomFilterMatrix, HashedKeys, murmur128, HASH_SEEDED, HASH_DOUBLE
+from travelers import SimulationConfig, Network, Trips, DetectionStore, Counter, OnlineCounter, odMatrix
+from travelers.ingest import IngestServer, simulateGates
+from travelers.od import odMatrixSets
+from travelers.rolling import RollingStore
+from tripquery import TripQueryEngine, setSize
+
+# Checks that the fast paths give exactly the results of the straightforward ones they replace.
+# Every check asserts bit-for-bit equality of the filters (or equality of the sets) and equality
+# of the estimates, and prints its name when it passes. CHECKS lists them by name.
+#
+#   python check.py
+#   python check.py --only rolling
+
+HASHINGS = [HASH_SEEDED, HASH_DOUBLE]
+
+def quietly(fn, *args):
+	# Call fn without its progress output
+	with contextlib.redirect_stdout(io.StringIO()):
+		return fn(*args)
+
+def smallConfig(**constants):
+	# A configuration that is small enough to run the reference loops on
+	base = dict(NUM_LOCATIONS = 4, NUM_TRIPS = 1000, EPOCH_LENGTH = 10, MAX_DETECTIONS = 1000,
+							SEED = 1, VECTORIZED = True)
+	base.update(constants)
+	return SimulationConfig(**base)
+
+def storeOf(config, trips = None):
+	# A DetectionStore with the detections of the trips of config
+	store = DetectionStore(config)
+	store.store(trips if trips is not None else quietly(Trips.generate, config))
+	return store
+
+def sameResult(a, b):
+	# Whether two (set, estSizeSrc, estSize) results are equal, filters bit for bit and sketches
+	# value for value
+	setA, setB = a[0], b[0]
+	if hasattr(setA, 'words'):
+		same = (setA.words() == setB.words()).all()
+	elif hasattr(setA, 'theta'):
+		same = setA.theta == setB.theta and (setA.hashes == setB.hashes).all()
+	else:
+		same = set(setA) == set(setB)
+	return bool(same) and tuple(a[1:]) == tuple(b[1:])
+
+def checkRolling():
+	# The daily summaries of a rolling store against counting every day on its own, and the days
+	# it evicted against their detections
+	rolling, results, days = None, [], []
+	with tempfile.TemporaryDirectory() as directory:
+		for day in range(4):
+			config  = smallConfig(SEED = day, PROB_RETURN = 0.3)
+			rolling = rolling or RollingStore(config, 2, 4, directory)
+			store   = storeOf(config)
+			results.append(Counter(config, store.tripSet).findAllSingleTrips())
+			days.append(numpy.array([detections.words() for detections in store.tripSet]))
+			rolling.addDay(store.tripSet)
+		rolling.finish()
+		for day, result in enumerate(results):
+			assert(sameResult(rolling.dayCount(day), result)), day
+		for day in range(2):
+			assert((rolling.loadDay(day).grid()[0] == days[day]).all()), day
+
+def checkMurmur():
+	# The vectorized MurmurHash3 of double hashing against mmh3
+	ids    = numpy.random.default_rng(1).integers(-(1 << 62), 1 << 62, 1000)
+	h1, h2 = murmur128(ids)
+	for i, item in enumerate(ids.tolist()):
+		digest = mmh3.hash128(item.to_bytes(8, 'little', signed = True), seed = 0, signed = False)
+		assert(int(h1[i]) | (int(h2[i]) << 64) == digest), item
+
+def checkHashing():
+	# Batches of items, and of keys hashed in advance, against adding and checking them one by one
+	ids = numpy.random.default_rng(2).choice(10000000, 2000, replace = False)
+	for hashing in HASHINGS:
+		single = BloomFilter(0, 0, 9973, 7, hashing)
+		batch  = BloomFilter(0, 0, 9973, 7, hashing)
+		keyed  = BloomFilter(0, 0, 9973, 7, hashing)
+		for item in ids[:1000].tolist():
+			single.add(item)
+		batch.add_many(ids[:1000])
+		keyed.add_many(HashedKeys(ids[:1000], hashing, 7))
+		assert(single.bit_array == batch.bit_array == keyed.bit_array), hashing
+		assert(batch.check_many(ids).tolist() == [single.check(item) for item in ids.tolist()]), hashing
+
+def checkSaturation():
+	# Estimates of full filters, which undersized filters reach, are finite and as large as they get
+	for hashing in HASHINGS:
+		for track_fill in (False, True):
+			full = BloomFilter(0, 0, 1009, 3, hashing, track_fill)
+			full.add_many(numpy.arange(20000))
+			assert(full.numOnes() == full.size), (hashing, track_fill)
+			assert(full.estimatedSize() == full.sizeFromOnes(full.size - 1) == full.sizeFromOnes(full.size))
+			assert(full.estimatedIntersectionSize(full) == full.intersection(full).estimatedSize() == full.estimatedSize())
+	config  = smallConfig(MAX_DETECTIONS = 30, PROB_RETURN = 0.5)
+	rng     = numpy.random.default_rng(config.SEED)
+	network = quietly(Network.generateVectorized, config, rng)
+	store   = storeOf(config, quietly(Trips.drawVectorized, config, network, rng))
+	counter = Counter(config, store.tripSet)
+	union, estSizeSrc, estSize = counter.findAllSingleTrips()
+	assert(union.numOnes() == union.size and union.estimatedSize() == union.sizeFromOnes(union.size))
+	quietly(counter.findAllCommuters)
+	assert(numpy.isfinite(odMatrix(config, store, network)).all())
+
+def referenceSingleTrips(config, counter):
+	# findAllSingleTrips as the nested loops over departure and arrival epochs
+	union, estSizeSrc, estSize = config.emptySet(), 0, 0
+	for epochDep in config.departureEpochs():
+		departing = config.emptySet()
+		for epochArr in config.expectedArrEpochs(epochDep):
+			trips     = counter.findOneWayTrips(epochDep, epochArr)
+			estSize   = estSize + setSize(trips)
+			departing = departing.union(trips)
+		estSizeSrc = estSizeSrc + setSize(departing)
+		union      = union.union(departing)
+	return union, estSizeSrc, estSize
+
+def referenceCommuters(config, counter):
+	# findAllCommuters as the nested loops over the epochs of both trips
+	union, estSizeSrc, estSize = config.emptySet(), 0, 0
+	lastDepRet = config.epoch(config.LASTDEP_RET)
+	for epochDepSrc in config.departureEpochs():
+		departing = config.emptySet()
+		for epochArrDst in config.expectedArrEpochs(epochDepSrc):
+			for epochDepDst in range(epochArrDst + 1, lastDepRet):
+				for epochArrSrc in config.expectedArrEpochs(epochDepDst):
+					trips, size = counter.findTwoWayTrips(epochDepSrc, epochArrDst, epochDepDst, epochArrSrc)
+					estSize     = estSize + size
+					departing   = departing.union(trips)
+		estSizeSrc = estSizeSrc + setSize(departing)
+		union      = union.union(departing)
+	return union, estSizeSrc, estSize
+
+def checkEngine():
+	# The query engine, with its caches large or too small to hold anything, against the nested loops
+	for constants in (dict(), dict(HASHING = HASH_DOUBLE), dict(USE_SETS = True)):
+		config  = smallConfig(NUM_LOCATIONS = 2, EPOCH_LENGTH = 30, PROB_RETURN = 0.5, **constants)
+		counter = Counter(config, storeOf(config).tripSet)
+		singles, commuters = referenceSingleTrips(config, counter), referenceCommuters(config, counter)
+		for cache_budget in (1 << 27, 1):
+			counter.engine = TripQueryEngine(counter.tripSet, config.plan(), config.emptySet, cache_budget = cache_budget)
+			assert(sameResult(counter.findAllSingleTrips(), singles)), constants
+			assert(sameResult(quietly(counter.findAllCommuters), commuters)), constants
+
+def checkWorkers():
+	# Departure epochs dealt out over worker processes against a single process
+	for constants in (dict(), dict(USE_SETS = True)):
+		config  = smallConfig(PROB_RETURN = 0.5, **constants)
+		tripSet = storeOf(config).tripSet
+		single  = Counter(config, tripSet)
+		config.WORKERS = 2
+		workers = Counter(config, tripSet)
+		assert(sameResult(single.findAllSingleTrips(), workers.findAllSingleTrips())), constants
+		assert(sameResult(quietly(single.findAllCommuters), quietly(workers.findAllCommuters))), constants
+
+def checkSaveLoad():
+	# A store written to a file and memory-mapped again
+	config = smallConfig()
+	store  = storeOf(config)
+	with tempfile.TemporaryDirectory() as directory:
+		fileName = os.path.join(directory, "store.bfg")
+		store.save(fileName)
+		loaded = DetectionStore.load(config, fileName)
+		assert((loaded.tripSetLoc.bits == store.tripSetLoc.bits).all())
+		assert(sameResult(Counter(config, loaded.tripSet).findAllSingleTrips(),
+											Counter(config, store.tripSet).findAllSingleTrips()))
+
+def checkSketch():
+	# The query engine on small sketches, whose unions are truncated, against the nested loops
+	config  = smallConfig(NUM_LOCATIONS = 2, EPOCH_LENGTH = 30, PROB_RETURN = 0.5, USE_SKETCH = True, SKETCH_SIZE = 64)
+	counter = Counter(config, storeOf(config).tripSet)
+	assert(sameResult(counter.findAllSingleTrips(), referenceSingleTrips(config, counter)))
+	assert(sameResult(quietly(counter.findAllCommuters), referenceCommuters(config, counter)))
+
+def checkCompactSets():
+	# Sorted integer arrays against Python sets
+	results = []
+	for compact in (False, True):
+		config = smallConfig(USE_SETS = True, COMPACT_SETS = compact, PROB_RETURN = 0.5)
+		counter = Counter(config, storeOf(config).tripSet)
+		results.append((counter.findAllSingleTrips(), quietly(counter.findAllCommuters)))
+	for plain, compact in zip(*results):
+		assert(sameResult(plain, compact))
+
+def checkOnline():
+	# Closing the epochs of a day one by one against counting the whole day
+	for constants in (dict(), dict(HASHING = HASH_DOUBLE), dict(USE_SETS = True)):
+		config  = smallConfig(**constants)
+		tripSet = storeOf(config).tripSet
+		online  = OnlineCounter(config)
+		for detections in tripSet:
+			online.close(detections)
+		assert(sameResult(online.counts(), Counter(config, tripSet).findAllSingleTrips())), constants
+
+def checkOD():
+	# The OD matrix of the filter grid against intersecting the filters of every pair one by one
+	for hashing in HASHINGS:
+		config    = smallConfig(HASHING = hashing)
+		rng       = numpy.random.default_rng(config.SEED)
+		network   = quietly(Network.generateVectorized, config, rng)
+		store     = storeOf(config, quietly(Trips.drawVectorized, config, network, rng))
+		filters   = types.SimpleNamespace(tripSetLoc = [[store.tripSetLoc.filter(location, epoch)
+																							for epoch in range(config.numEpochs())]
+																							for location in range(config.NUM_LOCATIONS)])
+		union, summed = odMatrix(config, store, network)
+		reference     = odMatrixSets(config, filters, network)
+		assert((union == reference[0]).all() and (summed == reference[1]).all()), hashing
+
+def checkStore():
+	# DetectionStore, which hashes every traveler once, against adding every detection on its own
+	for hashing in HASHINGS:
+		config    = smallConfig(HASHING = hashing)
+		trips     = quietly(Trips.generate, config)
+		store     = storeOf(config, trips)
+		template  = config.emptySet()
+		reference = BloomFilterMatrix(config.NUM_LOCATIONS, config.numEpochs(), fixed_size = template.size,
+																	fixed_hash_count = template.hash_count, hashing = hashing)
+		tripEpochs = trips.epochs(config)
+		for traveler, src, dst, dep, arr in zip(*(tripEpochs[field].tolist() for field in
+																						 ("traveler", "src", "dst", "dep_epoch", "arr_epoch"))):
+			reference.add(src, dep, traveler)
+			reference.add(dst, arr, traveler)
+		assert((store.tripSetLoc.bits == reference.bits).all()), hashing
+
+def checkPlan():
+	# The epoch plan against expectedArrEpochs in nested loops, and the engine, which takes the
+	# return pairs from the plan, with its return pairs in chunks of one
+	for epochLength in (5, 10, 30):
+		config = smallConfig(EPOCH_LENGTH = epochLength)
+		plan   = config.plan()
+		lastDepRet = config.epoch(config.LASTDEP_RET)
+		pairs  = [(dep, arr) for dep in config.departureEpochs() for arr in config.expectedArrEpochs(dep)]
+		quads  = [(dep, arr, depRet, arrRet) for dep, arr in pairs for depRet in range(arr + 1, lastDepRet)
+							for arrRet in config.expectedArrEpochs(depRet)]
+		assert(plan.pairs.tolist() == [list(pair) for pair in pairs]), epochLength
+		assert(plan.quads.tolist() == [list(quad) for quad in quads]), epochLength
+		assert(plan.cost(True).sum() == len(pairs) + len(quads)), epochLength
+		assert(sorted(sum(plan.chunks(3, True), [])) == list(config.departureEpochs())), epochLength
+	config  = smallConfig(NUM_LOCATIONS = 2, EPOCH_LENGTH = 30, PROB_RETURN = 0.5)
+	counter = Counter(config, storeOf(config).tripSet)
+	commuters = referenceCommuters(config, counter)
+	counter.engine = TripQueryEngine(counter.tripSet, config.plan(), config.emptySet, memory_budget = 1)
+	assert(sameResult(quietly(counter.findAllCommuters), commuters))
+
+def checkIngest():
+	# Detections sent by simulated gates to the ingestion server against a DetectionStore of the
+	# same trips: the final counts, and the filters written per epoch (none for empty epochs)
+	for hashing in HASHINGS:
+		config = smallConfig(HASHING = hashing)
+		store  = storeOf(config)
+		completeSet, estSizeSrc, estSize = Counter(config, store.tripSet).findAllSingleTrips()
+		with tempfile.TemporaryDirectory() as directory:
+
+			async def ingest():
+				server   = IngestServer(config, directory)
+				consumer = asyncio.ensure_future(server.consume())
+				path     = os.path.join(directory, "gates.sock")
+				socket   = await server.serve(path)
+				counts   = await simulateGates(config, path)
+				await server.close(socket)
+				consumer.cancel()
+				return counts
+
+			counts = quietly(asyncio.run, ingest())
+			assert(counts[:3] == (completeSet.estimatedSize(), estSizeSrc, estSize)), hashing
+			grid = store.tripSetLoc.grid()
+			for epoch in range(config.numEpochs()):
+				fileName = os.path.join(directory, "day-00000-epoch-{:04d}.bfg".format(epoch))
+				if not os.path.exists(fileName):
+					assert(not grid[:, epoch].any()), (hashing, epoch)
+					continue
+				matrix = BloomFilterMatrix.load(fileName)
+				assert((matrix.grid()[:, 0] == grid[:, epoch]).all()), (hashing, epoch)
+
+def checkSkewedGate():
+	# A detection far in the future from one gate does not close the epochs of the other gates,
+	# nor the ones in which its own correct detections still arrive
+	config = smallConfig(NUM_LOCATIONS = 2)
+	server = IngestServer(config)
+	late   = config.END_OF_DAY - 1
+	server.ingest(numpy.array([[1, 0, 60], [2, 1, 60]]))
+	server.ingest(numpy.array([[3, 0, late]]))
+	server.ingest(numpy.array([[4, 0, 70], [5, 1, 70]]))
+	assert(server.late == 0 and server.records == 5 and server.online.epoch == 70 // config.EPOCH_LENGTH - 1)
+
+CHECKS = {
+	"murmur": checkMurmur,
+	"hashing": checkHashing,
+	"saturation": checkSaturation,
+	"engine": checkEngine,
+	"workers": checkWorkers,
+	"saveload": checkSaveLoad,
+	"sketch": checkSketch,
+	"compact": checkCompactSets,
+	"online": checkOnline,
+	"od": checkOD,
+	"store": checkStore,
+	"plan": checkPlan,
+	"ingest": checkIngest,
+	"skew": checkSkewedGate,
+	"rolling": checkRolling,
+}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Check that the fast paths equal the reference ones")
+	parser.add_argument("--only", nargs = "+", choices = sorted(CHECKS), help = "Run only these checks")
+	args = parser.parse_args()
+	for name in args.only or CHECKS:
+		CHECKS[name]()
+		print("ok", name)
@@ -0,0 +1,108 @@
+# Python 3 implementation of a compact, exact set of integer IDs, as a replacement for
+# Python sets of traveler IDs. Install numpy first (pip install numpy).
+import numpy
+
+ID_DTYPE = numpy.uint32 # Traveler IDs are below MAX_TRAVELERS, so 4 bytes per ID suffice
+
+
+class IntSet(object):
+
+	'''
+	Immutable-style set of non-negative integer IDs, kept as a sorted NumPy array without
+	duplicates. It takes 4 bytes per ID (a Python set of ints takes over 60), and intersections
+	and unions are merges of sorted arrays. It supports the part of the set interface that the
+	counting code uses: len(), in, iteration, &, |, intersection(), union() and update().
+	'''
+
+	def __init__(self, items=()):
+		'''
+		items : iterable or array of int
+			Initial IDs, in any order and possibly with duplicates
+		'''
+		self.items = IntSet.normalize(items)
+
+	@staticmethod
+	def normalize(items):
+		'''
+		Return the sorted, unique IDs of items as an ID_DTYPE array
+		'''
+		items = numpy.asarray(items if len(items) else [], dtype=numpy.int64).ravel()
+		assert(len(items) == 0 or (items.min() >= 0 and items.max() <= numpy.iinfo(ID_DTYPE).max))
+		return IntSet.dedup(numpy.sort(items.astype(ID_DTYPE)))
+
+	@staticmethod
+	def dedup(items):
+		'''
+		Return a sorted array without its repeated values
+		'''
+		if len(items) < 2:
+			return items
+		return items[numpy.concatenate(([True], items[1:] != items[:-1]))]
+
+	@staticmethod
+	def merge(a, b):
+		'''
+		Return the union of two sorted arrays without duplicates. The stable sort (timsort)
+		recognizes the two sorted runs and merges them in linear time.
+		'''
+		return IntSet.dedup(numpy.sort(numpy.concatenate((a, b)), kind='stable'))
+
+	@classmethod
+	def fromSorted(cls, items):
+		'''
+		Return a set wrapping an array that is already sorted and without duplicates
+		'''
+		intSet = cls()
+		intSet.items = items
+		return intSet
+
+	def __len__(self):
+		return len(self.items)
+
+	def __iter__(self):
+		return iter(self.items.tolist())
+
+	def __contains__(self, item):
+		i = numpy.searchsorted(self.items, item)
+		return bool(i < len(self.items) and self.items[i] == item)
+
+	def __eq__(self, other):
+		if isinstance(other, IntSet):
+			return numpy.array_equal(self.items, other.items)
+		return set(self) == other
+
+	def __repr__(self):
+		return "IntSet({})".format(self.items.tolist())
+
+	def update(self, items):
+		'''
+		Add IDs to this set, in place
+		'''
+		self.items = IntSet.merge(self.items, IntSet.normalize(items))
+
+	def intersection(self, other):
+		'''
+		Return the intersection of two sets. Every element of the smaller set is looked up
+		in the larger one, so the cost is O(small * log(large)).
+		'''
+		small, large = sorted((self.items, other.items), key=len)
+		if len(small) == 0:
+			return IntSet()
+		i = numpy.searchsorted(large, small).clip(max=len(large) - 1)
+		return IntSet.fromSorted(small[large[i] == small])
+
+	def union(self, other):
+		'''
+		Return the union of two sets
+		'''
+		if len(other.items) == 0:
+			return IntSet.fromSorted(self.items)
+		if len(self.items) == 0:
+			return IntSet.fromSorted(other.items)
+		return IntSet.fromSorted(IntSet.merge(self.items, other.items))
+
+	def __and__(self, other):
+		return self.intersection(other)
+
+	def __or__(self, other):
+		return self.union(other)
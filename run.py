@@ -1,4 +1,4 @@
-import subprocess, sys
+from sweep import sweep
 
 # Input parameters:
 
@@ -11,11 +11,8 @@ import subprocess, sys
 # USE_SETS       = int(sys.argv[7])==1             # Decide whether we're going to use sets or Bloom filters
 # NUM_RUNS       = int(sys.argv[8])                # Number of runs for the same set of parameter values
 
-for ntrip in [100, 1000, 10000, 100000]:
-	for bfsize in [ 1 ]:
-		for prob in [ 10 ]:
-			command = ["python3", "travel-multiple-lines-fast.py", "2", "100", str(ntrip), "5", str(int(ntrip/bfsize)), str(prob), "0", "100"]
-			print(command)
-			subprocess.call(command)
-
-
+# The configurations run concurrently; those already in results-bfs.txt are skipped. The guard
+# keeps worker processes, which import this module when they are spawned, from sweeping again.
+if __name__ == "__main__":
+	sweep(trips = [100, 1000, 10000, 100000], epochs = [5], bfsizes = [1], probs = [10], sets = [0],
+				locations = 2, link = 100, runs = 100)
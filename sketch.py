@@ -0,0 +1,145 @@
+# Python 3 implementation of a k-minimum-values (theta) sketch, as an alternative to Bloom
+# filters for counting. Install numpy, mmh3 and bitarray first (see bloomfilter.py).
+import numpy
+from bloomfilter import murmur128
+
+THETA_MAX = numpy.uint64((1 << 64) - 1)
+
+
+class ThetaSketch(object):
+
+	'''
+	K-minimum-values sketch of a set of integer IDs. Every ID is hashed to a uniform 64-bit
+	value, and only the (at most) k smallest hash values below a threshold theta are kept.
+	The number of items is estimated as the number of kept values divided by theta (as a
+	fraction of the hash range).
+
+	Unlike HyperLogLog, the sketch is closed under both union and intersection: the result of
+	either is again a sketch with theta the minimum of both thresholds, so the unions of
+	intersections built by the counting functions can be estimated directly. Its accuracy does
+	not degrade as the union grows: the relative standard error is about 1/sqrt(k), whatever
+	the number of items. Intersection does not distribute over union, however: a union keeps
+	only the k smallest hash values, so A∩(B∪C) may miss values that (A∩B)∪(A∩C) keeps.
+	'''
+
+	distributive = False # A∩(B∪C) may differ from (A∩B)∪(A∩C), see above
+
+	def __init__(self, k=4096):
+		'''
+		k : int
+			Maximum number of hash values kept (the sketch takes 8*k bytes)
+		'''
+		assert(k > 0)
+		self.k = k
+		self.theta = THETA_MAX
+		self.hashes = numpy.empty(0, dtype=numpy.uint64) # Sorted, unique, all below theta
+
+	def hash_many(self, ids):
+		'''
+		Return the 64-bit hash values of a batch of IDs
+		'''
+		h1, h2 = murmur128(ids)
+		return h1
+
+	def add(self, item):
+		'''
+		Add an item to the sketch
+		'''
+		self.add_many([item])
+
+	def add_many(self, ids):
+		'''
+		Add a batch of items to the sketch
+		'''
+		hashes = self.hash_many(ids)
+		self.keep(numpy.union1d(self.hashes, hashes[hashes < self.theta]))
+
+	def keep(self, hashes):
+		'''
+		Keep the sorted hashes below theta, lowering theta to the (k+1)-th smallest if there
+		are more than k of them
+		'''
+		if len(hashes) > self.k:
+			self.theta = hashes[self.k]
+			hashes = hashes[:self.k]
+		self.hashes = hashes
+
+	def check(self, item):
+		'''
+		Check for existence of an item. Only items whose hash is kept can be found, so this
+		is only reliable while the sketch is exact (not saturated).
+		'''
+		h = self.hash_many([item])[0]
+		i = numpy.searchsorted(self.hashes, h)
+		return bool(i < len(self.hashes) and self.hashes[i] == h)
+
+	def exact(self):
+		'''
+		Return whether the sketch still holds all its items
+		'''
+		return self.theta == THETA_MAX
+
+	def numOnes(self):
+		'''
+		Return the number of hash values kept
+		'''
+		return len(self.hashes)
+
+	def stats(self):
+		'''
+		Return the capacity, number of kept hash values, fill ratio and threshold of this sketch
+		'''
+		t = self.numOnes()
+		return {"size": self.k, "hash_count": 1, "set_bits": t, "fill_ratio": t / self.k,
+						"theta": float(self.theta) / float(THETA_MAX)}
+
+	def ls(self):
+		'''
+		Return [capacity, 1, kept hash values, fill ratio] of this sketch, as BloomFilter.ls()
+		'''
+		stats = self.stats()
+		return [stats["size"], stats["hash_count"], stats["set_bits"], stats["fill_ratio"]]
+
+	def estimatedSize(self):
+		'''
+		Estimate the size of the set represented by this sketch
+		'''
+		if self.exact():
+			return len(self.hashes)
+		return int(len(self.hashes) * (float(THETA_MAX) / float(self.theta)))
+
+	def estimatedIntersectionSize(self, sketch):
+		'''
+		Estimate the size of the intersection with another sketch
+		'''
+		return self.intersection(sketch).estimatedSize()
+
+	def estimatedUnionSize(self, sketch):
+		'''
+		Estimate the size of the union with another sketch
+		'''
+		return self.union(sketch).estimatedSize()
+
+	def intersection(self, sketch):
+		'''
+		Return the intersection of two sketches
+		'''
+		assert(self.k == sketch.k)
+		theta = min(self.theta, sketch.theta)
+		intersectionSketch = ThetaSketch(self.k)
+		intersectionSketch.theta = theta
+		hashes = numpy.intersect1d(self.hashes, sketch.hashes, assume_unique=True)
+		intersectionSketch.hashes = hashes[hashes < theta]
+		return intersectionSketch
+
+	def union(self, sketch):
+		'''
+		Return the union of two sketches
+		'''
+		assert(self.k == sketch.k)
+		theta = min(self.theta, sketch.theta)
+		unionSketch = ThetaSketch(self.k)
+		unionSketch.theta = theta
+		hashes = numpy.union1d(self.hashes, sketch.hashes)
+		unionSketch.keep(hashes[hashes < theta])
+		return unionSketch
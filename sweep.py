@@ -0,0 +1,97 @@
+import argparse, itertools, os
+from concurrent.futures import ProcessPoolExecutor
+from travelers import SimulationConfig, Trips, run, resultLine, appendResult
+from travelers.experiment import RESULTS
+
+# Runs an experiment for every combination of a grid of parameter values, on a pool of at most a
+# given number of worker processes that stay alive between runs. Runs that share NUM_LOCATIONS,
+# PROB_LINK and NUM_TRIPS reuse one generated network and trip set, and configurations that
+# already have a line in the results file are skipped, so an interrupted sweep can simply be
+# restarted.
+
+# Columns of NUM_TRIPS, EPOCH_LENGTH, MAX_DETECTIONS and PROB_BF_FALSE in a line of the results
+# file. resultLine writes them right-aligned in fixed widths, so full-width values are not
+# separated by whitespace.
+KEY_COLUMNS = [(1, 8), (8, 13), (13, 21), (21, 28)]
+
+def recordedConfigs(fileName = RESULTS):
+	# Return the (USE_SETS, NUM_TRIPS, EPOCH_LENGTH, MAX_DETECTIONS, PROB_BF_FALSE) tuples that
+	# already have a line in the results file
+	recorded = set()
+	if not os.path.exists(fileName):
+		return recorded
+	with open(fileName) as f:
+		for line in f:
+			if len(line) < KEY_COLUMNS[-1][1] or line[0] not in "SB":
+				continue
+			trips, epoch, detections, prob = (line[start:stop] for start, stop in KEY_COLUMNS)
+			try:
+				recorded.add((line[0] == "S", int(trips), int(epoch), int(detections), round(float(prob), 4)))
+			except ValueError:
+				continue
+	return recorded
+
+def configKey(config):
+	# Key of a configuration as it appears in the results file
+	return (config.USE_SETS, config.NUM_TRIPS, config.EPOCH_LENGTH, config.MAX_DETECTIONS,
+					round(config.PROB_BF_FALSE, 4))
+
+loadedTrips = {} # Trips loaded by a worker process, per trip file
+
+def runConfig(config, tripFile, results):
+	# Run one configuration in a worker process, reusing trips it already loaded
+	trips = loadedTrips.get(tripFile)
+	if trips is None:
+		trips = Trips.obtain(config, tripFile)
+		loadedTrips.clear()
+		loadedTrips[tripFile] = trips
+	result = run(config, trips = trips)
+	appendResult(resultLine(config, result), results)
+	return result
+
+def sweep(trips, epochs, bfsizes, probs, sets, locations = 2, link = 100, runs = 100, workers = 4,
+					tripDir = "trips", results = RESULTS):
+	# Run all configurations of the grid. MAX_DETECTIONS is NUM_TRIPS / bfsize, and probs are given
+	# in the units of the script (1/10000).
+	configs = []
+	for ntrip, epochLength, bfsize, prob, useSets in itertools.product(trips, epochs, bfsizes, probs, sets):
+		configs.append(SimulationConfig(NUM_LOCATIONS = locations, PROB_LINK = link/100, NUM_TRIPS = ntrip,
+																		EPOCH_LENGTH = epochLength, MAX_DETECTIONS = int(ntrip / bfsize),
+																		PROB_BF_FALSE = prob/10000.0, USE_SETS = useSets == 1, NUM_RUNS = runs))
+
+	recorded = recordedConfigs(results)
+	todo     = [config for config in configs if configKey(config) not in recorded]
+	print(len(configs) - len(todo), "of", len(configs), "configurations already recorded in", results)
+
+	# Group the configurations by the trips they need, so that every group generates its trips once
+	os.makedirs(tripDir, exist_ok = True)
+	groups = {}
+	for config in todo:
+		tripFile = os.path.join(tripDir, "trips-{}-{}-{}.pkl".format(locations, link, config.NUM_TRIPS))
+		groups.setdefault(tripFile, []).append(config)
+
+	# First one run per missing trip file, generating it, then all remaining runs
+	first = [(group[0], tripFile) for tripFile, group in groups.items() if not os.path.exists(tripFile)]
+	rest  = [(config, tripFile) for tripFile, group in groups.items() for config in group \
+					 if not any(config is firstConfig for firstConfig, f in first)]
+	with ProcessPoolExecutor(max_workers = workers) as pool:
+		outcomes = [future.result() for future in [pool.submit(runConfig, c, f, results) for c, f in first]]
+		outcomes = outcomes + [future.result() for future in [pool.submit(runConfig, c, f, results) for c, f in rest]]
+	return outcomes
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Parallel parameter sweep of counting experiments")
+	parser.add_argument("--trips", type = int, nargs = "+", default = [100, 1000, 10000, 100000], help = "NUM_TRIPS values")
+	parser.add_argument("--epochs", type = int, nargs = "+", default = [5], help = "EPOCH_LENGTH values (minutes)")
+	parser.add_argument("--bfsizes", type = float, nargs = "+", default = [1], help = "MAX_DETECTIONS = NUM_TRIPS / bfsize")
+	parser.add_argument("--probs", type = int, nargs = "+", default = [10], help = "PROB_BF_FALSE values (in 1/10000)")
+	parser.add_argument("--sets", type = int, nargs = "+", default = [0], help = "USE_SETS values (0 or 1)")
+	parser.add_argument("--locations", type = int, default = 2, help = "NUM_LOCATIONS")
+	parser.add_argument("--link", type = int, default = 100, help = "PROB_LINK (in %%)")
+	parser.add_argument("--runs", type = int, default = 100, help = "NUM_RUNS")
+	parser.add_argument("--workers", type = int, default = os.cpu_count(), help = "Number of concurrent runs")
+	parser.add_argument("--trip-dir", default = "trips", help = "Directory for generated networks and trips")
+	args = parser.parse_args()
+
+	sweep(args.trips, args.epochs, args.bfsizes, args.probs, args.sets, args.locations, args.link, args.runs,
+				args.workers, args.trip_dir)
@@ -0,0 +1,10 @@
+# Counting travelers between locations with sets or Bloom filters, as a library. The command line
+# front end is travel-multiple-lines-fast.py.
+from travelers.config import SimulationConfig, accuracy
+from travelers.network import Network
+from travelers.trips import Trips
+from travelers.detections import DetectionStore
+from travelers.counter import Counter
+from travelers.online import OnlineCounter
+from travelers.od import odMatrix
+from travelers.experiment import run, resultLine, appendResult
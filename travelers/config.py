@@ -0,0 +1,162 @@
+from bloomfilter import BloomFilter, HASH_SEEDED
+from intset import IntSet
+from sketch import ThetaSketch
+from travelers.plan import EpochPlan
+
+class SimulationConfig(object):
+
+	'''
+	All parameters of a simulation, with the time helpers that depend on them
+	'''
+
+	def __init__(self, NUM_LOCATIONS=2, PROB_LINK=1.0, NUM_TRIPS=1000, EPOCH_LENGTH=5, MAX_DETECTIONS=1000,
+							 PROB_BF_FALSE=0.001, USE_SETS=False, USE_SKETCH=False, NUM_RUNS=1, WORKERS=1, HASHING=HASH_SEEDED, **constants):
+		'''
+		NUM_LOCATIONS : int
+			Size of the network
+		PROB_LINK : float
+			Probability of making a link between two nodes
+		NUM_TRIPS : int
+			Total number of trips in the network
+		EPOCH_LENGTH : int
+			Epoch length in minutes
+		MAX_DETECTIONS : int
+			Maximum number of detections/epoch supported (global)
+		PROB_BF_FALSE : float
+			Tolerated false positives in Bloom filters
+		USE_SETS : bool
+			Decide whether we're going to use sets or Bloom filters
+		USE_SKETCH : bool
+			Use k-minimum-values sketches of SKETCH_SIZE hashes instead of Bloom filters
+		NUM_RUNS : int
+			Number of runs for the same set of parameter values
+		WORKERS : int
+			Number of processes counting departure epochs
+		HASHING : str
+			HASH_SEEDED (reference bits) or HASH_DOUBLE (vectorized batch hashing)
+		constants :
+			Overrides of the constants below, e.g. PROB_RETURN=0.5
+		'''
+		self.NUM_LOCATIONS  = NUM_LOCATIONS
+		self.PROB_LINK      = PROB_LINK
+		self.NUM_TRIPS      = NUM_TRIPS
+		self.EPOCH_LENGTH   = EPOCH_LENGTH
+		self.MAX_DETECTIONS = MAX_DETECTIONS
+		self.PROB_BF_FALSE  = PROB_BF_FALSE
+		self.USE_SETS       = USE_SETS
+		self.USE_SKETCH     = USE_SKETCH
+		self.NUM_RUNS       = NUM_RUNS
+		self.WORKERS        = WORKERS
+		self.HASHING        = HASHING
+
+		self.MAX_TRAVELERS = 10000000 # Maximum number of traveler IDs to generate
+		self.START_OF_DAY  = 5*60     # Start time of first trip in minutes
+		self.END_OF_DAY    = 24*60    # Last time that we can have an arrival (in minutes)
+		self.LASTDEP_OUT   = 22*60    # Last possible departure time at A (still allowing a return trip)
+		self.LASTDEP_RET   = 23*60    # Last possible departure time at B (still guaranteeing to arrive)
+		self.PROB_RETURN   = 0        # Probability that someone will also make a return trip
+		self.MIN_TRIPTIME  = 15       # Minimum trip time
+		self.MAX_TRIPTIME  = 30       # Maximum trip time 
+		self.STD_TRIPTIME  = 0.2      # Standard deviation expressed in fraction of average trip time
+		self.SEED          = None     # Seed for the random generators (None: do not seed)
+		self.VECTORIZED    = False    # Generate the network and trips with NumPy instead of the reference loops
+		self.BF_SIZE       = 0        # Bloom filter size m, with BF_HASH_COUNT (0: size from MAX_DETECTIONS, PROB_BF_FALSE)
+		self.BF_HASH_COUNT = 0        # Number of hash functions k of the Bloom filters, with BF_SIZE
+		self.SKETCH_SIZE   = 4096     # Number of hash values kept per sketch (USE_SKETCH)
+		self.COMPACT_SETS  = False    # With USE_SETS, keep the IDs in sorted NumPy arrays instead of Python sets
+		self.NETWORK       = None     # Edge list file (see Network.load) to use instead of a random network
+		self.TRACE         = None     # File to write an instrumentation trace of run() to (see travelers/instrument.py)
+
+		for name, value in constants.items():
+			assert(hasattr(self, name)), name
+			setattr(self, name, value)
+
+	@classmethod
+	def fromArgv(cls, argv):
+		'''
+		Return the configuration for the command line arguments of travel-multiple-lines-fast.py
+		(without the program name), and the value of its --trips option
+		'''
+		argv    = list(argv)
+		options = {"--workers": "1", "--trips": None, "--sketch": None, "--trace": None, "--network": None,
+							 "--hashing": HASH_SEEDED}
+		for option in options:
+			if option in argv:
+				i = argv.index(option)
+				options[option] = argv[i + 1]
+				del argv[i:i + 2]
+		flags = {"--vectorized": False, "--compact": False}
+		for flag in flags:
+			if flag in argv:
+				flags[flag] = True
+				argv.remove(flag)
+
+		config = cls(NUM_LOCATIONS  = int(argv[0]),
+								 PROB_LINK      = float(int(argv[1])/100),     # in %
+								 NUM_TRIPS      = int(argv[2]),
+								 EPOCH_LENGTH   = int(argv[3]),
+								 MAX_DETECTIONS = int(argv[4]),
+								 PROB_BF_FALSE  = float(int(argv[5])/10000.0), # in %%%
+								 USE_SETS       = int(argv[6])==1,
+								 NUM_RUNS       = int(argv[7]),
+								 WORKERS        = int(options["--workers"]),
+								 HASHING        = options["--hashing"],
+								 VECTORIZED     = flags["--vectorized"],
+								 COMPACT_SETS   = flags["--compact"],
+								 TRACE          = options["--trace"],
+								 NETWORK        = options["--network"])
+		if options["--sketch"] is not None:
+			config.USE_SKETCH  = True
+			config.SKETCH_SIZE = int(options["--sketch"])
+		return config, options["--trips"]
+
+	def epoch(self, time):
+		# Simply return the epoch when given time in minutes
+		return int(time/self.EPOCH_LENGTH)
+
+	def numEpochs(self):
+		# Number of epochs in a day
+		return self.epoch(self.END_OF_DAY)
+
+	def departureEpochs(self):
+		# All epochs in which a trip can depart
+		return range(self.epoch(self.START_OF_DAY), self.epoch(self.END_OF_DAY))
+
+	def expectedArrEpochs(self, epochDep):
+		# Returns a conservative range of epochs to consider. For aggregating trips, the best we know is
+		# that a trip lasts at least MIN_TRIPTIME minutes, and at most MAX_TRIPTIME minutes. We also need
+		# to take the maximum possible standard deviation into account.
+		# We assume that a trip takes at least 1 epoch from src to dst.
+		maxStd   = self.STD_TRIPTIME * self.MAX_TRIPTIME
+		minEpoch = min(max(self.epoch(epochDep * self.EPOCH_LENGTH + self.MIN_TRIPTIME - 2 * maxStd), \
+											 epochDep + 1), self.epoch(self.END_OF_DAY))
+		maxEpoch = max(min(self.epoch((epochDep + 1) * self.EPOCH_LENGTH + self.MAX_TRIPTIME + 2 * maxStd), \
+											 self.epoch(self.END_OF_DAY)), self.epoch(self.START_OF_DAY))
+		assert(epochDep <= minEpoch)
+		assert(maxEpoch <= self.epoch(self.END_OF_DAY))
+		return range(minEpoch, maxEpoch)
+
+	def plan(self):
+		# The precomputed epoch windows of this configuration (expectedArrEpochs of every epoch, and
+		# all epoch pairs to intersect), built once
+		return EpochPlan.forConfig(self)
+
+	def emptySet(self):
+		# Return an empty set of detections, in the representation used by this configuration
+		if self.USE_SETS and self.COMPACT_SETS:
+			return IntSet()
+		elif self.USE_SETS:
+			return set()
+		elif self.USE_SKETCH:
+			return ThetaSketch(self.SKETCH_SIZE)
+		elif self.BF_SIZE:
+			return BloomFilter(fixed_size=self.BF_SIZE, fixed_hash_count=self.BF_HASH_COUNT, hashing=self.HASHING)
+		else:
+			return BloomFilter(self.MAX_DETECTIONS, self.PROB_BF_FALSE, hashing=self.HASHING)
+
+	def generationKey(self):
+		# The parameters that determine the generated network and trips
+		return (self.NUM_LOCATIONS, self.PROB_LINK, self.NUM_TRIPS, self.PROB_RETURN, self.SEED, self.VECTORIZED, self.NETWORK)
+
+def accuracy(real_count, measured_count):
+	return max(1 - abs(real_count - measured_count)/real_count, 0)
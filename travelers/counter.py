@@ -0,0 +1,137 @@
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy
+from bloomfilter import FilterRows
+from tripquery import TripQueryEngine
+
+class Counter(object):
+
+	'''
+	Counts single trips and commuters from the detections per epoch (tripSet, a sequence of sets,
+	Bloom filters or sketches)
+	'''
+
+	def __init__(self, config, tripSet):
+		self.config  = config
+		self.tripSet = tripSet
+
+		# The engine memoizes one-way trips and unions of return trips, which are shared between
+		# the searches for different departure epochs.
+		self.engine  = TripQueryEngine(tripSet, config.plan(), config.emptySet)
+
+	def findOneWayTrips(self, epochDep, epochArr):
+		# Find all trips departing at epochDep and arriving at epochArr
+		tripsFromSrc  = self.tripSet[epochDep]
+		tripsToDst	  = self.tripSet[epochArr]
+		oneWayTripSet = tripsFromSrc.intersection(tripsToDst)
+
+		return oneWayTripSet
+
+	def findTwoWayTrips(self, epochDepSrc, epochArrDst, epochDepDst, epochArrSrc):
+		# Find all two-way trips consisting of a trip departing at epochDepSrc, arriving at
+		# epochArrDst, and later departing at epochDepDst and arriving at epochArrSrc.
+		outwardTrips	= self.findOneWayTrips(epochDepSrc, epochArrDst)
+		returnTrips		= self.findOneWayTrips(epochDepDst, epochArrSrc)
+		twoWayTrips		= outwardTrips.intersection(returnTrips)
+
+		# We count trips in two ways: by returning the size of the found intersections (and adding
+		# these to a final result), as well as computing the entire set of trips and then taking the
+		# size of that set. Using Bloom filters, the second method should be less accurate.
+		if self.config.USE_SETS:
+			return twoWayTrips, len(twoWayTrips)
+		else:
+			return twoWayTrips, twoWayTrips.estimatedSize()
+
+	def findCommuters(self, epochDepSrc):
+		# Find all commuters who left during epochDepSrc. This is the union of all
+		# findTwoWayTrips(epochDepSrc, epochArrDst, epochDepDst, epochArrSrc) for arrivals
+		# epochArrDst in expectedArrEpochs(epochDepSrc), return departures epochDepDst after
+		# epochArrDst, and return arrivals epochArrSrc in expectedArrEpochs(epochDepDst).
+
+		print(">>>>>", epochDepSrc)
+
+		return self.engine.commuters(epochDepSrc)
+
+	def findAllCommuters(self):
+		return self.findAll(self.findCommuters)
+
+	def findSingleTrips(self, epochDepSrc):
+		# Find all single trips who left during epochDepSrc, i.e., the union of
+		# findOneWayTrips(epochDepSrc, epochArrDst) for all epochArrDst in expectedArrEpochs(epochDepSrc)
+
+		return self.engine.singleTrips(epochDepSrc)
+
+	def findAllSingleTrips(self):
+		return self.findAll(self.findSingleTrips)
+
+	def findDepartures(self, find, epochs):
+		# Aggregate the results of find (findSingleTrips or findCommuters) over the given departure epochs
+		commuterSet = self.config.emptySet()
+		estSize    = 0 # The aggregated estimated size by adding the number of trips
+		estSizeSrc = 0 # The aggregated size of the commuterset starting from a specific epoch 
+		for epochDepSrc in epochs:
+			commuterSetSrc, size = find(epochDepSrc)
+			estSize              = estSize + size
+			if self.config.USE_SETS:
+				estSizeSrc         = estSizeSrc + len(commuterSetSrc)
+			else:
+				estSizeSrc         = estSizeSrc + commuterSetSrc.estimatedSize()
+			commuterSet          = commuterSet.union(commuterSetSrc)
+		return commuterSet, estSizeSrc, estSize
+
+	def findAll(self, find):
+		# Find all trips for every departure epoch of the day. The departure epochs are independent, so
+		# with WORKERS > 1 they are dealt out over a process pool and the partial results are merged.
+		epochs  = self.config.departureEpochs()
+		workers = self.config.WORKERS
+		if workers <= 1:
+			return self.findDepartures(find, epochs)
+		chunks  = self.config.plan().chunks(workers, find.__name__ == "findCommuters") # Of about equal work
+
+		# Bloom filters are handed to the workers as one packed matrix in shared memory. Sets and
+		# sketches are passed once per worker.
+		memory = None
+		if self.config.USE_SETS or self.config.USE_SKETCH:
+			shared = self.tripSet
+		else:
+			words  = numpy.array([bf.words() for bf in self.tripSet])
+			memory = shared_memory.SharedMemory(create = True, size = max(words.nbytes, 1))
+			numpy.ndarray(words.shape, dtype = numpy.uint64, buffer = memory.buf)[:] = words
+			shared = (memory.name, words.shape, self.tripSet[0].size, self.tripSet[0].hash_count)
+
+		try:
+			with multiprocessing.Pool(workers, initWorker, (self.config, shared)) as pool:
+				results = pool.starmap(findWorkerDepartures, [(find.__name__, chunk) for chunk in chunks])
+		finally:
+			if memory is not None:
+				memory.close()
+				memory.unlink()
+
+		commuterSet = self.config.emptySet()
+		estSizeSrc  = 0
+		estSize     = 0
+		for commuterSetPart, estSizeSrcPart, estSizePart in results:
+			commuterSet = commuterSet.union(commuterSetPart)
+			estSizeSrc  = estSizeSrc + estSizeSrcPart
+			estSize     = estSize + estSizePart
+		return commuterSet, estSizeSrc, estSize
+
+workerCounter = None # Counter of a worker process
+workerMemory  = None # Shared memory block attached by a worker process
+
+def initWorker(config, shared):
+	# Runs once in every worker: attach to the per-epoch detections and set up a counter over them
+	global workerCounter, workerMemory
+	if config.USE_SETS or config.USE_SKETCH:
+		tripSet = shared
+	else:
+		name, shape, size, hash_count = shared
+		workerMemory = shared_memory.SharedMemory(name = name)
+		words        = numpy.ndarray(shape, dtype = numpy.uint64, buffer = workerMemory.buf)
+		tripSet      = FilterRows(words, size, hash_count, config.HASHING)
+	workerCounter = Counter(config, tripSet)
+
+def findWorkerDepartures(findName, epochs):
+	# Task of a worker process: aggregate findSingleTrips or findCommuters over some departure epochs
+	counter = workerCounter
+	return counter.findDepartures(getattr(counter, findName), epochs)
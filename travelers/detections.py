@@ -0,0 +1,80 @@
+import numpy
+from bloomfilter import BloomFilterMatrix, EpochUnions, HashedKeys
+
+class DetectionStore(object):
+
+	'''
+	Detections of travelers, stored in either sets, Bloom filters or sketches. Those sets are
+	ordered, per location, by epochs. In principle, we can compute the number of commuters per (src,dst) pair.
+	To compute all commuters, we build a list of detections per epoch, taking all locations
+	together. This will allow a faster computation in comparison to doing this on a per
+	(src,dst)-pair basis.
+	'''
+
+	def __init__(self, config):
+		self.config = config
+
+		# Only the representation in use is allocated. The Bloom filters of all (location, epoch)
+		# pairs share a single packed bit matrix.
+		if config.USE_SETS or config.USE_SKETCH:
+			self.tripSetLoc = [[config.emptySet() for epochs in range(config.numEpochs())] \
+												 for locations in range(config.NUM_LOCATIONS)] # Detections per location, per epoch
+			self.tripSet    = [config.emptySet() for epochs in range(config.numEpochs())] # Detections per epoch
+		else:
+			template        = config.emptySet()
+			self.tripSetLoc = BloomFilterMatrix(config.NUM_LOCATIONS, config.numEpochs(), fixed_size=template.size, \
+																					fixed_hash_count=template.hash_count, hashing=config.HASHING)
+			self.tripSet    = [] # Built from tripSetLoc by store
+
+	def store(self, trips):
+		# Store the detections of the given trips: each trip is detected at its source in the departure
+		# epoch, and at its destination in the arrival epoch
+		tripEpochs = trips.epochs(self.config)
+		travelers  = numpy.concatenate((tripEpochs["traveler"], tripEpochs["traveler"]))
+		locations  = numpy.concatenate((tripEpochs["src"], tripEpochs["dst"])).astype(numpy.int64)
+		epochs     = numpy.concatenate((tripEpochs["dep_epoch"], tripEpochs["arr_epoch"])).astype(numpy.int64)
+
+		if self.config.USE_SETS or self.config.USE_SKETCH:
+			# Group the detections per (location, epoch) so that they can be inserted in one batch
+			order  = numpy.lexsort((epochs, locations))
+			rows   = (locations * self.config.numEpochs() + epochs)[order]
+			starts = numpy.flatnonzero(numpy.diff(rows, prepend = -1))
+			for start, stop in zip(starts, numpy.append(starts[1:], len(rows))):
+				loc, e = divmod(int(rows[start]), self.config.numEpochs())
+				ids    = travelers[order[start:stop]]
+				if self.config.USE_SETS:
+					self.tripSetLoc[loc][e].update(ids if self.config.COMPACT_SETS else ids.tolist())
+				else:
+					self.tripSetLoc[loc][e].add_many(ids)
+		else:
+			# Every traveler is detected at least twice, so hash each one once and reuse its hashes
+			unique, inverse = numpy.unique(travelers, return_inverse = True)
+			keys = HashedKeys(unique, self.tripSetLoc.hashing, self.tripSetLoc.hash_count).take(inverse)
+			self.tripSetLoc.add_rows(locations * self.config.numEpochs() + epochs, keys)
+
+		# And aggregate all trips into a single list, ordered by epoch
+		if self.config.USE_SETS or self.config.USE_SKETCH:
+			for e in range(self.config.numEpochs()):
+				for loc in range(self.config.NUM_LOCATIONS):
+					self.tripSet[e] = self.tripSet[e].union(self.tripSetLoc[loc][e])
+		else:
+			self.tripSet = [self.tripSetLoc.toFilter(words) for words in self.tripSetLoc.aggregate()]
+
+	def save(self, fileName):
+		# Write the Bloom filter grid in the binary format of BloomFilterMatrix.save
+		assert(not self.config.USE_SETS and not self.config.USE_SKETCH)
+		self.tripSetLoc.epoch_length = self.config.EPOCH_LENGTH
+		self.tripSetLoc.save(fileName)
+
+	@classmethod
+	def load(cls, config, fileName):
+		# A store whose Bloom filter grid is memory-mapped from a file written by save. The
+		# detections per epoch are aggregated over the locations when they are read.
+		assert(not config.USE_SETS and not config.USE_SKETCH)
+		store = cls.__new__(cls)
+		store.config     = config
+		store.tripSetLoc = BloomFilterMatrix.load(fileName)
+		assert(store.tripSetLoc.grid().shape[:2] == (config.NUM_LOCATIONS, config.numEpochs()))
+		assert(store.tripSetLoc.epoch_length == config.EPOCH_LENGTH)
+		store.tripSet    = EpochUnions(store.tripSetLoc)
+		return store
@@ -0,0 +1,90 @@
+import random
+import time
+import numpy
+from travelers.config import accuracy
+from travelers.counter import Counter
+from travelers.detections import DetectionStore
+from travelers.trips import Trips
+
+RESULTS = "results-bfs.txt"
+
+def run(config, tripFile = None, trips = None):
+	# Run an experiment: generate (or load, or reuse the given) trips, store their detections, and
+	# count all single trips NUM_RUNS times. Returns a dictionary with the averaged results. With
+	# config.TRACE set, the run is instrumented and its trace is written to that file.
+	if not config.TRACE:
+		return runExperiment(config, tripFile, trips)
+	from travelers import instrument
+	instrument.enable()
+	try:
+		return runExperiment(config, tripFile, trips)
+	finally:
+		instrument.disable()
+		instrument.save(config.TRACE)
+
+def runExperiment(config, tripFile, trips):
+	time_start = time.time()
+	if config.SEED is not None:
+		random.seed(config.SEED)
+		numpy.random.seed(config.SEED)
+
+	if trips is None:
+		trips = Trips.obtain(config, tripFile)
+	store   = DetectionStore(config)
+	store.store(trips)
+	counter = Counter(config, store.tripSet)
+
+	completeSetSize  = 0
+	estSizeMid       = 0
+	estSizeFine      = 0
+	averageBFSize    = 0
+	averageNumOnes   = 0
+
+	for r in range(config.NUM_RUNS):
+		completeSet, estSizeMidTmp, estSizeFineTmp = counter.findAllSingleTrips()
+		if config.USE_SETS:
+			completeSetSize = completeSetSize + len(completeSet)
+		else:
+			completeSetSize = completeSetSize + completeSet.estimatedSize()
+			lsBF            = completeSet.ls()
+			averageBFSize   = averageBFSize   + lsBF[0]
+			averageNumOnes  = averageNumOnes  + lsBF[2]
+		estSizeMid  = estSizeMid  + estSizeMidTmp
+		estSizeFine = estSizeFine + estSizeFineTmp
+
+	return {"numOfReturners":  trips.numOfReturners,
+					"completeSetSize": int(completeSetSize / config.NUM_RUNS),
+					"estSizeMid":      int(estSizeMid / config.NUM_RUNS),
+					"estSizeFine":     int(estSizeFine / config.NUM_RUNS),
+					"averageBFSize":   int(averageBFSize / config.NUM_RUNS),
+					"averageNumOnes":  int(averageNumOnes / config.NUM_RUNS),
+					"time_elapsed":    time.time() - time_start}
+
+def resultLine(config, result):
+	# Format the results of an experiment as a line of results-bfs.txt
+	outputString = "\n"
+	if config.USE_SETS:
+		outputString = outputString + "S"
+	elif config.USE_SKETCH:
+		outputString = outputString + "K"
+	else:
+		outputString = outputString + "B"
+	outputString = outputString + "{:7d}".format(config.NUM_TRIPS)
+	outputString = outputString + "{:5d}".format(config.EPOCH_LENGTH)
+	outputString = outputString + "{:8d}".format(config.MAX_DETECTIONS)
+	outputString = outputString + "{:7.4f}".format(config.PROB_BF_FALSE)
+	outputString = outputString + "{:7d}".format(result["numOfReturners"])
+	outputString = outputString + "{:7d}".format(result["completeSetSize"])
+	outputString = outputString + "{:8.2f}".format(accuracy(config.NUM_TRIPS, result["completeSetSize"]) * 100)
+	outputString = outputString + "{:7d}".format(result["estSizeMid"])
+	outputString = outputString + "{:8.2f}".format(accuracy(config.NUM_TRIPS, result["estSizeMid"]) * 100)
+	outputString = outputString + "{:7d}".format(result["estSizeFine"])
+	outputString = outputString + "{:8.2f}".format(accuracy(config.NUM_TRIPS, result["estSizeFine"]) * 100)
+	outputString = outputString + "{:12.4f}".format((result["averageNumOnes"] / max(result["averageBFSize"], 1)))
+	outputString = outputString + "{:10.2f}".format(result["time_elapsed"])
+	return outputString
+
+def appendResult(outputString, fileName = RESULTS):
+	f = open(fileName, "a")
+	f.write(outputString)
+	f.close()
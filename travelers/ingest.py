@@ -0,0 +1,362 @@
+# Ingestion of live detections. Gate readers send (traveler, location, time) records in batches,
+# over a local (Unix) socket or by appending them to a file that the server tails. The records are
+# hashed into the Bloom filters of their (location, epoch) with the vectorized HashedKeys path.
+# When the time of the detections has passed an epoch (plus a grace period for gates that lag
+# behind), the epoch is closed: its filters are written to the directory, one file per epoch in
+# the format of BloomFilterMatrix.save, and counted by an OnlineCounter. Epochs without detections
+# are counted as empty, and not written. The time of the detections is the watermark: the earliest
+# of the latest detection times of all locations that have sent any, so that a gate with a clock
+# that runs ahead cannot close the epochs of the others. A location that stops sending keeps the
+# epochs open until it sends again, or until the day is flushed. A flush closes the day and
+# starts the next one, whose detection times start at 0 again. Only the open epochs are
+# kept in memory, and the batches wait in a bounded queue; a reader whose batch does not fit
+# waits, and stops reading its socket, until there is room again. Queries are answered between
+# batches.
+#
+# The socket protocol has one command per line:
+#   D traveler location time [traveler location time ...]   a batch of detections (no reply)
+#   Q                                                       reply with the running counts
+#   F                                                       close all epochs of the day, reply with
+#                                                           its final counts (or with "E error" if
+#                                                           they could not all be written), and
+#                                                           start the next day
+# Counts are replied as "completeSetSize estSizeMid estSizeFine epoch records late". In a tailed
+# file, every line is one record "traveler location time".
+#
+#   python -m travelers.ingest --socket /tmp/gates.sock --directory filters
+#   python -m travelers.ingest --tail detections.txt --follow
+#   python -m travelers.ingest --simulate --trips 10000
+import argparse
+import asyncio
+import os
+import sys
+import numpy
+from bloomfilter import BloomFilterMatrix, HashedKeys, HASH_SEEDED, HASH_DOUBLE
+from travelers.config import SimulationConfig
+from travelers.online import OnlineCounter
+from travelers.trips import Trips
+
+MAX_LINE = 1 << 20 # Longest accepted line (batch) in bytes
+
+def parseRecords(text):
+	# An (n, 3) array of the (traveler, location, time) records in a line or block of text
+	return numpy.array(text.split(), dtype = bytes).astype(numpy.int64).reshape(-1, 3)
+
+def parseLines(text):
+	# The records of a block of lines with one record each, and the number of malformed lines
+	# (not three integers that fit in 64 bits) that were skipped
+	try:
+		# Every line ends with a ";" token, so that lines with other than three fields are noticed
+		fields = numpy.array((text.rstrip(b"\n") + b"\n").replace(b"\n", b" ; ").split(), dtype = bytes).reshape(-1, 4)
+		if (fields[:, 3] == b";").all():
+			return fields[:, :3].astype(numpy.int64), 0
+	except (ValueError, OverflowError):
+		pass
+	records   = []
+	malformed = 0
+	for line in text.splitlines():
+		if not line.strip():
+			continue
+		try:
+			record = parseRecords(line)
+		except (ValueError, OverflowError):
+			record = None
+		if record is None or len(record) != 1:
+			malformed = malformed + 1
+		else:
+			records.append(record)
+	return (numpy.concatenate(records) if records else numpy.zeros((0, 3), dtype = numpy.int64)), malformed
+
+def formatRecords(records):
+	# A batch of records as a D command
+	return b"D " + b" ".join(b"%d" % value for value in records.ravel().tolist()) + b"\n"
+
+class IngestServer(object):
+
+	'''
+	Collects detections into per-(location, epoch) Bloom filters while the day goes on, and counts
+	the single trips of the epochs that have been closed. Use it from a running event loop: start
+	serve (and tail, for files), and await flush at the end of the day.
+	'''
+
+	def __init__(self, config, directory = None, queue_size = 64, grace = None):
+		'''
+		config : SimulationConfig
+			Epochs, locations and filters (USE_SETS and USE_SKETCH are not supported)
+		directory : str
+			Where closed epochs are written, or None to keep nothing
+		queue_size : int
+			Maximum number of batches waiting to be hashed
+		grace : int
+			Minutes after the end of an epoch during which its detections are still accepted,
+			EPOCH_LENGTH by default
+		'''
+		assert(not config.USE_SETS and not config.USE_SKETCH)
+		self.config    = config
+		self.directory = directory
+		self.grace     = config.EPOCH_LENGTH if grace is None else grace
+		self.queue     = asyncio.Queue(queue_size)
+		self.template  = config.emptySet()
+		self.writes    = []                    # Pending writes of closed epochs
+		self.handlers  = {}                    # Task serving a connection -> its writer
+		self.day       = -1
+		self.newDay()
+
+		if directory is not None:
+			os.makedirs(directory, exist_ok = True)
+
+	def newDay(self):
+		# Start counting the next day, with all epochs open and times from 0 again
+		self.day       = self.day + 1
+		self.online    = OnlineCounter(self.config) # Counts the closed epochs; online.epoch is the first open one
+		self.open      = {}                         # epoch -> BloomFilterMatrix (locations x 1) of its detections
+		self.latest    = numpy.full(self.config.NUM_LOCATIONS, -1, dtype = numpy.int64) # Latest detection time per location
+		self.watermark = 0                          # Earliest latest time of the locations that sent any
+		self.records   = 0                          # Detections hashed
+		self.late      = 0                          # Detections dropped: epoch already closed, invalid or malformed
+
+	def filters(self, epoch):
+		# The filters of an open epoch, allocated on its first detection
+		matrix = self.open.get(epoch)
+		if matrix is None:
+			matrix = BloomFilterMatrix(self.config.NUM_LOCATIONS, 1, fixed_size = self.template.size,
+																 fixed_hash_count = self.template.hash_count, hashing = self.config.HASHING)
+			matrix.epoch_length = self.config.EPOCH_LENGTH
+			self.open[epoch] = matrix
+		return matrix
+
+	def ingest(self, records):
+		# Hash a batch of records into the filters of their epochs, and close the epochs that the
+		# detections have left behind. Detections of closed epochs cannot be counted any more.
+		epochs = records[:, 2] // self.config.EPOCH_LENGTH
+		valid  = (epochs >= self.online.epoch) & (epochs < self.config.numEpochs()) & \
+						 (records[:, 1] >= 0) & (records[:, 1] < self.config.NUM_LOCATIONS)
+		self.late = self.late + int((~valid).sum())
+		if valid.any():
+			records, epochs = records[valid], epochs[valid]
+			keys = HashedKeys(records[:, 0], self.config.HASHING, self.template.hash_count)
+			for epoch in numpy.unique(epochs).tolist():
+				inEpoch = numpy.flatnonzero(epochs == epoch)
+				self.filters(epoch).add_rows(records[inEpoch, 1], keys.take(inEpoch))
+			self.records = self.records + len(records)
+			numpy.maximum.at(self.latest, records[:, 1], records[:, 2])
+			self.watermark = max(self.watermark, int(self.latest[self.latest >= 0].min()))
+		while self.online.epoch < self.config.numEpochs() and \
+					(self.online.epoch + 1) * self.config.EPOCH_LENGTH + self.grace <= self.watermark:
+			self.closeEpoch()
+
+	def closeEpoch(self):
+		# Count the first open epoch with the union of its filters over all locations, and write
+		# the filters in the background, if it had any detections
+		epoch  = self.online.epoch
+		matrix = self.open.pop(epoch, None)
+		if matrix is None:
+			self.online.close(self.config.emptySet())
+		else:
+			self.online.close(matrix.toFilter(matrix.aggregate()[0]))
+		if matrix is not None and self.directory is not None:
+			fileName = os.path.join(self.directory, "day-{:05d}-epoch-{:04d}.bfg".format(self.day, epoch))
+			self.writes.append(asyncio.get_running_loop().run_in_executor(None, matrix.save, fileName))
+			self.reap()
+
+	def reap(self):
+		# Forget the finished writes, reporting the ones that failed
+		for write in self.writes:
+			if write.done() and write.exception() is not None:
+				print("Writing a closed epoch failed:", write.exception(), file = sys.stderr)
+		self.writes = [write for write in self.writes if not write.done()]
+
+	async def closeDay(self):
+		# Close all open epochs, start the next day, and wait until the closed epochs have been
+		# written. Returns the final counts of the day, or raises the first error of the writes after
+		# all of them have finished.
+		while self.online.epoch < self.config.numEpochs():
+			self.closeEpoch()
+		counts = self.counts()
+		writes, self.writes = self.writes, []
+		self.newDay()
+		errors = [error for error in await asyncio.gather(*writes, return_exceptions = True) if error is not None]
+		if errors:
+			raise errors[0]
+		return counts
+
+	def counts(self):
+		# The running counts, as replied to queries
+		completeSetSize, estSizeMid, estSizeFine = self.online.estimates()
+		return (completeSetSize, estSizeMid, estSizeFine, self.online.epoch, self.records, self.late)
+
+	async def consume(self):
+		# Hash the queued batches one by one. A future in the queue is a flush: the day is closed,
+		# and the future gets its final counts, or the error. An error never stops the
+		# consumer, as the gates and flushes waiting on the queue would then wait forever.
+		while True:
+			batch = await self.queue.get()
+			try:
+				if isinstance(batch, asyncio.Future):
+					batch.set_result(await self.closeDay())
+				else:
+					self.ingest(batch)
+			except Exception as error:
+				if isinstance(batch, asyncio.Future):
+					batch.set_exception(error)
+				else:
+					print("Ingesting a batch failed:", error, file = sys.stderr)
+			self.queue.task_done()
+			await asyncio.sleep(0) # Let queries in between batches
+
+	async def flush(self):
+		# Close the day after all batches queued so far, and return its final counts
+		done = asyncio.get_running_loop().create_future()
+		await self.queue.put(done)
+		return await done
+
+	async def handle(self, reader, writer):
+		# Serve the commands of one connection. A reply to Q also tells the sender that all its
+		# earlier batches have been queued.
+		self.handlers[asyncio.current_task()] = writer
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				command = line[:1]
+				if command == b"D":
+					await self.queue.put(parseRecords(line[1:])) # Waits while the queue is full
+				elif command in (b"Q", b"F"):
+					try:
+						reply = " ".join(str(count) for count in (self.counts() if command == b"Q" else await self.flush()))
+					except OSError as error:
+						reply = "E " + str(error)
+					writer.write(reply.encode() + b"\n")
+					await writer.drain()
+		except (ValueError, OverflowError, asyncio.LimitOverrunError, ConnectionError):
+			pass # A malformed or too long line ends the connection
+		finally:
+			writer.close()
+			self.handlers.pop(asyncio.current_task(), None)
+
+	async def serve(self, path):
+		# Accept gate connections on a Unix socket
+		return await asyncio.start_unix_server(self.handle, path, limit = MAX_LINE)
+
+	async def close(self, socket):
+		# Stop accepting connections, and wait until the open ones have been closed by their gates
+		socket.close()
+		await socket.wait_closed()
+		await asyncio.gather(*self.handlers)
+
+	async def shutdown(self, socket = None):
+		# Stop accepting connections and drop the open ones, then close the day, so that its open
+		# epochs are still counted and written. Returns the final counts of the day.
+		if socket is not None:
+			socket.close()
+		for writer in list(self.handlers.values()):
+			writer.close() # The handler reads the end of its connection
+		await asyncio.gather(*self.handlers, return_exceptions = True)
+		return await self.flush()
+
+	async def tail(self, fileName, follow = False, blockSize = 1 << 16):
+		# Queue the records of a file in blocks; with follow, keep waiting for appended lines.
+		# Malformed lines are skipped, and counted as late.
+		pending = b""
+		with open(fileName, "rb") as f:
+			while True:
+				block = f.read(blockSize)
+				if not block:
+					if not follow:
+						break
+					await asyncio.sleep(0.1)
+					continue
+				text    = pending + block
+				end     = text.rfind(b"\n") + 1
+				pending = text[end:]
+				if end:
+					await self.queueLines(text[:end])
+		if pending.strip():
+			await self.queueLines(pending)
+
+	async def queueLines(self, text):
+		# Queue the records of a block of lines from a tailed file
+		records, malformed = parseLines(text)
+		self.late = self.late + malformed
+		await self.queue.put(records)
+
+def gateRecords(config, trips):
+	# The (traveler, location, time) detections of generated trips, at their departure and their
+	# arrival, in order of time
+	records = numpy.concatenate((numpy.stack((trips.trips["traveler"], trips.trips["src"], trips.trips["dep"]), axis = 1),
+															 numpy.stack((trips.trips["traveler"], trips.trips["dst"], trips.trips["arr"]), axis = 1)))
+	records = records.astype(numpy.int64)
+	return records[numpy.argsort(records[:, 2], kind = "stable")]
+
+async def simulateGates(config, path, batchSize = 256):
+	# A client for testing: one gate per location sends the detections of Trips.generate(config)
+	# at that location over its own connection, in batches of at most batchSize. The gates advance
+	# through the day together: after every epoch, each gate waits for the reply to a query, so the
+	# batches of an epoch are all queued before those of the next. Returns the final counts.
+	records  = gateRecords(config, Trips.generate(config))
+	epochs   = records[:, 2] // config.EPOCH_LENGTH
+	gates    = [await asyncio.open_unix_connection(path) for location in range(config.NUM_LOCATIONS)]
+
+	async def send(gate, batch):
+		reader, writer = gates[gate]
+		for start in range(0, len(batch), batchSize):
+			writer.write(formatRecords(batch[start:start + batchSize]))
+			await writer.drain()
+		writer.write(b"Q\n")
+		await writer.drain()
+		await reader.readline()
+
+	bounds = numpy.searchsorted(epochs, numpy.arange(config.numEpochs() + 1))
+	for epoch in range(config.numEpochs()):
+		batch = records[bounds[epoch]:bounds[epoch + 1]]
+		await asyncio.gather(*(send(gate, batch[batch[:, 1] == gate]) for gate in range(len(gates))))
+
+	reader, writer = gates[0]
+	writer.write(b"F\n")
+	await writer.drain()
+	counts = (await reader.readline()).split()
+	for reader, writer in gates:
+		writer.close()
+		await writer.wait_closed()
+	return tuple(int(count) for count in counts)
+
+async def main(args):
+	config = SimulationConfig(NUM_LOCATIONS = args.locations, NUM_TRIPS = args.trips, EPOCH_LENGTH = args.epoch,
+														MAX_DETECTIONS = args.detections, HASHING = args.hashing, SEED = args.seed,
+														VECTORIZED = True)
+	server   = IngestServer(config, args.directory, args.queue)
+	consumer = asyncio.ensure_future(server.consume())
+	socket   = None
+	try:
+		if args.tail:
+			await server.tail(args.tail, args.follow)
+			print(*await server.flush())
+		else:
+			socket = await server.serve(args.socket)
+			if args.simulate:
+				print(*await simulateGates(config, args.socket))
+			else:
+				await socket.serve_forever()
+			await server.close(socket)
+	except asyncio.CancelledError:
+		# Interrupted (Ctrl-C): the detections of the open epochs are not lost
+		print(*await server.shutdown(socket))
+	consumer.cancel()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Ingest gate detections into per-epoch Bloom filters")
+	parser.add_argument("--socket", default = "gates.sock", help = "Unix socket to serve")
+	parser.add_argument("--tail", help = "Read the records from this file instead")
+	parser.add_argument("--follow", action = "store_true", help = "Keep reading lines appended to the file")
+	parser.add_argument("--simulate", action = "store_true", help = "Run simulated gates against the socket, and exit")
+	parser.add_argument("--directory", help = "Write the filters of closed epochs here")
+	parser.add_argument("--queue", type = int, default = 64, help = "Maximum number of queued batches")
+	parser.add_argument("--locations", type = int, default = 2, help = "NUM_LOCATIONS")
+	parser.add_argument("--trips", type = int, default = 1000, help = "NUM_TRIPS of the simulated gates")
+	parser.add_argument("--epoch", type = int, default = 5, help = "EPOCH_LENGTH (minutes)")
+	parser.add_argument("--detections", type = int, default = 1000, help = "MAX_DETECTIONS per filter")
+	parser.add_argument("--hashing", choices = [HASH_SEEDED, HASH_DOUBLE], default = HASH_DOUBLE, help = "Hashing scheme")
+	parser.add_argument("--seed", type = int, default = 1, help = "SEED of the simulated trips")
+	args = parser.parse_args()
+	asyncio.run(main(args))
@@ -0,0 +1,190 @@
+# Opt-in instrumentation of the Bloom filters and the counting code. enable() wraps the
+# instrumented functions and methods, and disable() restores the originals, so that nothing is
+# measured and nothing is slowed down unless it is turned on. While enabled, the wrappers count
+# filter allocations, bit operations (per filter, also those done on whole arrays of filters at
+# once), hash computations, bits set and estimates, and time every call
+# and every phase of an experiment (network, trips, aggregation, counting and every departure
+# epoch). Only the calling process is measured: the worker processes of WORKERS > 1 are not.
+#
+# save() writes the trace as JSON: the counters, the phases in the order they ended, and per
+# function the number of calls, own time and cumulative time. stats() reads such a file back
+# as a pstats.Stats, the summary format of cProfile:
+#
+#   python -m travelers.instrument trace.json
+import functools
+import json
+import pstats
+import sys
+import time
+import numpy
+from bloomfilter import BloomFilter, BloomFilterMatrix, HashedKey, HashedKeys
+import tripquery
+from travelers import od
+from travelers.network import Network
+from travelers.trips import Trips
+from travelers.detections import DetectionStore
+from travelers.counter import Counter
+
+PHASE = "~" # File name of phases in the function keys, as cProfile uses for built-ins
+
+class Tracer(object):
+
+	'''
+	Counters and timings collected while instrumentation is enabled
+	'''
+
+	def __init__(self):
+		self.counters  = {"allocations": 0, "bit_ops": 0, "hashes": 0, "bits_set": 0, "estimates": 0}
+		self.functions = {} # (file, line, name) -> [calls, own time, cumulative time, {caller: calls}]
+		self.phases    = [] # {"name", "parent", "start", "duration"} per ended phase
+		self.stack     = [] # [key, start, time spent in callees] per running call
+		self.origin    = time.perf_counter()
+
+	def call(self, key, fn, args, kwargs, phase=False):
+		# Call fn, accounting its time to key
+		caller = self.stack[-1][0] if self.stack else None
+		frame  = [key, time.perf_counter(), 0.0]
+		self.stack.append(frame)
+		try:
+			return fn(*args, **kwargs)
+		finally:
+			self.stack.pop()
+			elapsed = time.perf_counter() - frame[1]
+			entry   = self.functions.setdefault(key, [0, 0.0, 0.0, {}])
+			entry[0] = entry[0] + 1
+			entry[1] = entry[1] + elapsed - frame[2]
+			if not any(key == running[0] for running in self.stack):
+				entry[2] = entry[2] + elapsed
+			if caller is not None:
+				entry[3][caller] = entry[3].get(caller, 0) + 1
+				self.stack[-1][2] = self.stack[-1][2] + elapsed
+			if phase:
+				self.phases.append({"name": key[2], "parent": caller[2] if caller else None,
+														"start": frame[1] - self.origin, "duration": elapsed})
+
+	def trace(self):
+		# The trace as a JSON-serializable dictionary
+		return {"counters": dict(self.counters), "phases": self.phases,
+						"functions": [{"file": key[0], "line": key[1], "name": key[2], "calls": calls, "tottime": tottime,
+													 "cumtime": cumtime, "callers": [[caller[0], caller[1], caller[2], n] for caller, n in callers.items()]}
+													for key, (calls, tottime, cumtime, callers) in self.functions.items()]}
+
+tracer  = None # The Tracer while instrumentation is enabled
+patched = []   # (owner, name, original attribute) of every wrapped attribute
+
+def instrument(owner, name, counter=None, amount=None, phase=None):
+	'''
+	Replace owner.name (a function, method or classmethod) by a wrapper that times it and, if
+	counter is given, adds amount(*args) (or 1) to that counter. counter can also be a dictionary
+	of counters and their amount functions. If phase is given, the call is recorded as a phase
+	named phase(*args).
+	'''
+	counts   = counter if isinstance(counter, dict) else {counter: amount} if counter else {}
+	original = owner.__dict__[name]
+	fn       = original.__func__ if isinstance(original, classmethod) else original
+	code     = fn.__code__
+	key      = (code.co_filename, code.co_firstlineno, fn.__qualname__)
+
+	@functools.wraps(fn)
+	def wrapper(*args, **kwargs):
+		for name, amount in counts.items():
+			tracer.counters[name] = tracer.counters[name] + (int(amount(*args, **kwargs)) if amount else 1)
+		if phase is not None:
+			return tracer.call((PHASE, 0, phase(*args, **kwargs)), fn, args, kwargs, phase=True)
+		return tracer.call(key, fn, args, kwargs)
+
+	patched.append((owner, name, original))
+	setattr(owner, name, classmethod(wrapper) if isinstance(original, classmethod) else wrapper)
+
+def returnPairs(engine, outwardTrips, epochArrDst):
+	# The number of return pairs that returnSizes intersects with the outward trips
+	start, stop = engine.plan.returnRange(epochArrDst)
+	return stop - start
+
+def enable():
+	'''
+	Start collecting counters and timings in a new tracer, and return it
+	'''
+	global tracer
+	disable()
+	tracer = Tracer()
+
+	# Bloom filters
+	instrument(BloomFilter, "__init__", "allocations")
+	# Keys hashed in advance are counted when they are hashed, not when their positions are used
+	instrument(BloomFilter, "positions", "hashes", lambda bf, item: 0 if isinstance(item, HashedKey) else bf.hash_count)
+	instrument(BloomFilter, "positions_many", "hashes",
+						 lambda bf, ids: 0 if isinstance(ids, HashedKeys) else len(ids) * bf.hash_count)
+	instrument(HashedKey, "__init__", "hashes", lambda key, item, hashing=None, hash_count=1: hash_count)
+	instrument(HashedKeys, "__init__", "hashes", lambda keys, ids, hashing=None, hash_count=1: len(ids) * hash_count)
+	instrument(BloomFilter, "intersection", "bit_ops")
+	instrument(BloomFilter, "union", "bit_ops")
+	instrument(BloomFilter, "numOnes")
+	instrument(BloomFilter, "estimatedSize", "estimates")
+	instrument(BloomFilter, "estimatedIntersectionSize", "estimates")
+	instrument(BloomFilterMatrix, "__init__", "allocations")
+	instrument(BloomFilterMatrix, "add_rows", "bits_set", lambda matrix, rows, ids: len(rows) * matrix.hash_count)
+	instrument(BloomFilterMatrix, "aggregate", "bit_ops", lambda matrix: matrix.locations * matrix.epochs)
+
+	# Counting
+	instrument(tripquery.TripQueryEngine, "oneWay")
+	instrument(tripquery.TripQueryEngine, "departing")
+	instrument(tripquery.TripQueryEngine, "returnTrips")
+	instrument(tripquery.TripQueryEngine, "returnSizes", {"bit_ops": returnPairs, "estimates": returnPairs})
+	instrument(od, "oneWayFilters", "bit_ops", lambda grid, src, dst, epochDep, arrEpochs: 2 * len(src) * len(arrEpochs))
+	instrument(od, "estimateSizes", "estimates", lambda ones, size, hashes: numpy.size(ones))
+	instrument(Counter, "findDepartures")
+
+	# Phases
+	instrument(Network, "generate", phase=lambda cls, config: "network")
+	instrument(Network, "generateVectorized", phase=lambda cls, config, rng: "network")
+	instrument(Trips, "draw", phase=lambda cls, config, network: "trips")
+	instrument(Trips, "drawVectorized", phase=lambda cls, config, network, rng: "trips")
+	instrument(DetectionStore, "store", phase=lambda store, trips: "aggregation")
+	instrument(Counter, "findAll", phase=lambda counter, find: "counting " + find.__name__)
+	instrument(Counter, "findSingleTrips", phase=lambda counter, epoch: "departure epoch {}".format(epoch))
+	instrument(Counter, "findCommuters", phase=lambda counter, epoch: "departure epoch {}".format(epoch))
+	return tracer
+
+def disable():
+	'''
+	Restore all instrumented functions. The last tracer stays available.
+	'''
+	while patched:
+		owner, name, original = patched.pop()
+		setattr(owner, name, original)
+
+def save(fileName, trace=None):
+	'''
+	Write the trace of the last tracer (or the given trace) as JSON
+	'''
+	with open(fileName, "w") as f:
+		json.dump(trace or tracer.trace(), f, indent=1)
+
+class TraceProfile(object):
+
+	'''
+	A saved trace in the form that pstats.Stats reads from cProfile.Profile
+	'''
+
+	def __init__(self, fileName):
+		with open(fileName) as f:
+			self.trace = json.load(f)
+
+	def create_stats(self):
+		self.stats = {}
+		for function in self.trace["functions"]:
+			key     = (function["file"], function["line"], function["name"])
+			callers = {(caller[0], caller[1], caller[2]): (caller[3], caller[3], 0.0, 0.0) for caller in function["callers"]}
+			self.stats[key] = (function["calls"], function["calls"], function["tottime"], function["cumtime"], callers)
+
+def stats(fileName):
+	'''
+	Return the trace in fileName as a pstats.Stats
+	'''
+	return pstats.Stats(TraceProfile(fileName))
+
+if __name__ == "__main__":
+	with open(sys.argv[1]) as f:
+		print(json.load(f)["counters"])
+	stats(sys.argv[1]).sort_stats("cumulative").print_stats(30)
@@ -0,0 +1,137 @@
+import random
+import numpy
+
+SRC = 0 # Index of the source in a link
+DST = 1 # Index of the destination in a link
+AVG = 2 # Index of the average trip time in a link
+STD = 3 # Index of the standard deviation in a link
+
+class Network(object):
+
+	'''
+	A network stored as a collection of directed links, each having a source, destination,
+	average trip time, with a specific standard deviation.
+	'''
+
+	def __init__(self, numLocations):
+		self.numLocations = numLocations
+		self.outLinks     = [[] for i in range(numLocations)]
+		self._csr         = None
+		self._links       = None
+
+	@classmethod
+	def generate(cls, config):
+		# We construct a random undirected network with asymmetric travel times. We optimistically assume
+		# that the network will be connected, which is true for a reasonably chosen PROB_LINK.
+		network = cls(config.NUM_LOCATIONS)
+		for node1 in range(config.NUM_LOCATIONS):
+			for node2 in range(node1 + 1, config.NUM_LOCATIONS):
+				if random.random() < config.PROB_LINK: # construct two links between node1 and node2
+					avgtravel = random.randint(config.MIN_TRIPTIME, config.MAX_TRIPTIME)
+					stdtravel = int(config.STD_TRIPTIME * avgtravel)
+					network.outLinks[node1].append((node1, node2, avgtravel, stdtravel))
+					avgtravel = random.randint(config.MIN_TRIPTIME, config.MAX_TRIPTIME)
+					stdtravel = int(config.STD_TRIPTIME * avgtravel)
+					network.outLinks[node2].append((node2, node1, avgtravel, stdtravel))
+		print("Network generated")
+		return network
+
+	@classmethod
+	def generateVectorized(cls, config, rng):
+		# The same random (Erdos-Renyi) network as generate, drawn with the NumPy generator rng in time
+		# proportional to the number of links rather than the number of node pairs: the gaps between
+		# consecutive linked pairs, in the order of generate, are geometrically distributed.
+		node1, node2 = sampleUpperPairs(config.NUM_LOCATIONS, config.PROB_LINK, rng)
+
+		# Two links, with their own trip times, between node1 and node2
+		src = numpy.concatenate((node1, node2))
+		dst = numpy.concatenate((node2, node1))
+		avg = rng.integers(config.MIN_TRIPTIME, config.MAX_TRIPTIME + 1, len(src))
+		std = (config.STD_TRIPTIME * avg).astype(numpy.int64)
+		network = cls.fromLinks(config.NUM_LOCATIONS, src, dst, avg, std)
+		print("Network generated")
+		return network
+
+	@classmethod
+	def load(cls, config, fileName, undirected = False):
+		# Load a network from an edge list: one link per line, as "src dst [avg [std]]" separated by
+		# whitespace or commas, with nodes numbered from 0 and lines starting with # ignored. Links
+		# without an average trip time get the mean of MIN_TRIPTIME and MAX_TRIPTIME, and links
+		# without a standard deviation get STD_TRIPTIME times their average. If undirected is set,
+		# every link is also added in the opposite direction (unless the file has that link too).
+		with open(fileName) as f:
+			rows = [line.replace(",", " ").split() for line in f if line.strip() and not line.lstrip().startswith("#")]
+		edges = numpy.full((len(rows), 4), numpy.nan)
+		for i, row in enumerate(rows):
+			edges[i, :len(row)] = row
+		src = edges[:, 0].astype(numpy.int64)
+		dst = edges[:, 1].astype(numpy.int64)
+		avg = numpy.where(numpy.isnan(edges[:, 2]), (config.MIN_TRIPTIME + config.MAX_TRIPTIME) // 2, edges[:, 2]).astype(numpy.int64)
+		std = numpy.where(numpy.isnan(edges[:, 3]), (config.STD_TRIPTIME * avg).astype(numpy.int64), edges[:, 3]).astype(numpy.int64)
+		assert(len(src) == 0 or (min(src.min(), dst.min()) >= 0 and max(src.max(), dst.max()) < config.NUM_LOCATIONS))
+
+		if undirected:
+			keys    = src * config.NUM_LOCATIONS + dst
+			reverse = ~numpy.isin(dst * config.NUM_LOCATIONS + src, keys)
+			src, dst, avg, std = (numpy.concatenate((src, dst[reverse])), numpy.concatenate((dst, src[reverse])),
+														numpy.concatenate((avg, avg[reverse])), numpy.concatenate((std, std[reverse])))
+		network = cls.fromLinks(config.NUM_LOCATIONS, src, dst, avg, std)
+		print("Network loaded from", fileName)
+		return network
+
+	@classmethod
+	def fromLinks(cls, numLocations, src, dst, avg, std):
+		# Build a network from arrays with the source, destination, average and standard deviation
+		# of the trip time of every link
+		network = cls(numLocations)
+		order   = numpy.lexsort((dst, src))
+		src, dst, avg, std = (numpy.asarray(a, dtype = numpy.int64)[order] for a in (src, dst, avg, std))
+		for s, d, a, sd in zip(src.tolist(), dst.tolist(), avg.tolist(), std.tolist()):
+			network.outLinks[s].append((s, d, a, sd))
+		indptr = numpy.zeros(numLocations + 1, dtype = numpy.int64)
+		numpy.cumsum(numpy.bincount(src, minlength = numLocations), out = indptr[1:])
+		network._csr = (indptr, dst, avg, std)
+		return network
+
+	def csr(self):
+		# Return the links in compressed sparse row form: (indptr, dst, avg, std), where the links of
+		# node n are at indptr[n]:indptr[n+1], ordered by destination
+		if self._csr is None:
+			links  = sorted([l for outLinksSrc in self.outLinks for l in outLinksSrc])
+			links  = numpy.array(links, dtype = numpy.int64).reshape(-1, 4)
+			indptr = numpy.zeros(self.numLocations + 1, dtype = numpy.int64)
+			numpy.cumsum(numpy.bincount(links[:, SRC], minlength = self.numLocations), out = indptr[1:])
+			self._csr = (indptr, links[:, DST], links[:, AVG], links[:, STD])
+		return self._csr
+
+	def findLink(self, src, dst):
+		# Find the specific link that connects src to dst, in constant time through a dictionary of
+		# all links by (src, dst)
+		if self._links is None:
+			self._links = {(l[SRC], l[DST]): l for outLinksSrc in self.outLinks for l in outLinksSrc}
+		return self._links.get((src, dst), [])
+
+def sampleUpperPairs(numNodes, prob, rng):
+	# Return arrays node1 < node2 of the pairs of nodes that are linked with probability prob each,
+	# in the order (0, 1), (0, 2), ..., (1, 2), ... By drawing the gaps between linked pairs from a
+	# geometric distribution, the time is proportional to the number of links.
+	numPairs = numNodes * (numNodes - 1) // 2
+	if prob <= 0 or numPairs == 0:
+		return numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0, dtype = numpy.int64)
+
+	# Draw batches of gaps until their sum passes the last pair
+	pairs = []
+	last  = -1
+	while last < numPairs:
+		batch = int(numPairs * prob * 1.05) + 64
+		ranks = last + numpy.cumsum(rng.geometric(min(prob, 1.0), batch))
+		pairs.append(ranks[ranks < numPairs])
+		last  = ranks[-1]
+	pairs = numpy.concatenate(pairs)
+
+	# Node node1 starts its pairs at rank node1 * (2 * numNodes - node1 - 1) / 2
+	firsts = numpy.arange(numNodes, dtype = numpy.int64)
+	firsts = firsts * (2 * numNodes - firsts - 1) // 2
+	node1  = numpy.searchsorted(firsts, pairs, side = "right") - 1
+	node2  = pairs - firsts[node1] + node1 + 1
+	return node1, node2
@@ -0,0 +1,78 @@
+import numpy
+from bloomfilter import popcount
+from tripquery import setSize
+
+def linkedPairs(network):
+	# Return arrays with the source and destination of every link of the network. Trips can only
+	# be made between linked locations, so only those pairs need to be counted.
+	indptr, dst, avg, std = network.csr()
+	src = numpy.repeat(numpy.arange(network.numLocations), numpy.diff(indptr))
+	return src, dst
+
+def odMatrix(config, store, network, chunk = 64):
+	# Count the single trips per (src, dst) pair: the travelers detected at src in a departure epoch
+	# and at dst in one of its expected arrival epochs. Returns two NUM_LOCATIONS x NUM_LOCATIONS
+	# arrays: the size of the union of all one-way trip sets of a pair, and the sum of their sizes
+	# (as completeSetSize and estSizeFine of an experiment). Pairs without a link are zero.
+	if config.USE_SETS or config.USE_SKETCH:
+		return odMatrixSets(config, store, network)
+	return odMatrixFilters(config, store.tripSetLoc, network, chunk)
+
+def odMatrixSets(config, store, network):
+	# odMatrix for sets and sketches, one pair at a time
+	union  = numpy.zeros((config.NUM_LOCATIONS, config.NUM_LOCATIONS))
+	summed = numpy.zeros((config.NUM_LOCATIONS, config.NUM_LOCATIONS))
+	plan   = config.plan()
+	for src, dst in zip(*linkedPairs(network)):
+		tripsFromSrc = store.tripSetLoc[src]
+		tripsToDst   = store.tripSetLoc[dst]
+		oneWayTrips  = config.emptySet()
+		for epochDep in plan.departures:
+			if setSize(tripsFromSrc[epochDep]) == 0:
+				continue
+			for epochArr in plan.arrEpochs(epochDep):
+				trips            = tripsFromSrc[epochDep].intersection(tripsToDst[epochArr])
+				summed[src, dst] = summed[src, dst] + setSize(trips)
+				oneWayTrips      = oneWayTrips.union(trips)
+		union[src, dst] = setSize(oneWayTrips)
+	return union, summed
+
+def odMatrixFilters(config, matrix, network, chunk):
+	# odMatrix for a BloomFilterMatrix. The pairs are handled in chunks; per departure epoch, the
+	# filters of the sources are ANDed with those of the destinations in all arrival epochs at once,
+	# and the results are ORed into one union per pair. Sources without detections in a departure
+	# epoch, and destinations without any in its arrival epochs, are skipped.
+	grid   = matrix.grid()      # (locations, epochs, words)
+	ones   = popcount(grid)     # (locations, epochs)
+	size   = matrix.size
+	hashes = matrix.hash_count
+	union  = numpy.zeros((config.NUM_LOCATIONS, config.NUM_LOCATIONS))
+	summed = numpy.zeros((config.NUM_LOCATIONS, config.NUM_LOCATIONS))
+	plan   = config.plan()
+
+	pairSrc, pairDst = linkedPairs(network)
+	for start in range(0, len(pairSrc), chunk):
+		src = pairSrc[start:start + chunk]
+		dst = pairDst[start:start + chunk]
+		acc = numpy.zeros((len(src), matrix.nwords), dtype = numpy.uint64)
+		for epochDep in plan.departures:
+			arrEpochs = plan.pairsFrom(epochDep)[:, 1]
+			live      = (ones[src, epochDep] > 0) & ones[dst[:, None], arrEpochs[None, :]].any(axis = 1)
+			if len(arrEpochs) == 0 or not live.any():
+				continue
+			liveSrc, liveDst = src[live], dst[live]
+			trips, tripsUnion = oneWayFilters(grid, liveSrc, liveDst, epochDep, arrEpochs)
+			acc[live] |= tripsUnion
+			numpy.add.at(summed, (liveSrc, liveDst), estimateSizes(popcount(trips), size, hashes).sum(axis = 1))
+		union[src, dst] = estimateSizes(popcount(acc), size, hashes)
+	return union, summed
+
+def oneWayFilters(grid, src, dst, epochDep, arrEpochs):
+	# The one-way trip filters of the pairs (src[i], dst[i]) leaving in epochDep, one per arrival
+	# epoch, as a (pairs, arrivals, words) array, and per pair the union of them (pairs, words)
+	trips = grid[src, epochDep][:, None, :] & grid[dst[:, None], arrEpochs[None, :]]
+	return trips, numpy.bitwise_or.reduce(trips, axis = 1)
+
+def estimateSizes(ones, size, hashes):
+	# BloomFilter.sizeFromOnes for an array of numbers of ones
+	return numpy.floor(-1 * (size / hashes) * numpy.log(1 - numpy.minimum(ones, size - 1) / size))
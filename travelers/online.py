@@ -0,0 +1,77 @@
+from tripquery import setSize
+
+class OnlineCounter(object):
+
+	'''
+	Counts single trips while the day goes on, instead of after it. The detections of an epoch
+	(over all locations) are collected until the epoch is closed. Closing epoch a intersects its
+	detections only with those of the earlier departure epochs d whose window of arrival epochs,
+	config.expectedArrEpochs(d), contains a; the other intersections have been done before, or
+	will be done when their arrival epoch closes. Every close therefore does a bounded amount of
+	work, and the detections of a departure epoch are dropped once its window has passed.
+
+	After the last epoch of the day is closed, counts() equals Counter.findAllSingleTrips().
+	'''
+
+	def __init__(self, config):
+		self.config = config
+
+		# For every arrival epoch, the departure epochs whose window contains it, and for every
+		# departure epoch the last epoch of its window
+		self.departures = {}
+		self.lastArr    = {}
+		plan            = config.plan()
+		for epochDep in plan.departures:
+			arrEpochs = plan.arrEpochs(epochDep)
+			for epochArr in arrEpochs:
+				self.departures.setdefault(epochArr, []).append(epochDep)
+			self.lastArr[epochDep] = arrEpochs[-1] if len(arrEpochs) else epochDep
+
+		self.epoch       = 0                 # The epoch that is being collected
+		self.current     = config.emptySet() # Its detections so far
+		self.open        = {}                # epochDep -> detections, while its window has not passed
+		self.departing   = {}                # epochDep -> union of its one-way trips arrived so far
+		self.commuterSet = config.emptySet() # Union of all one-way trips so far
+		self.estSizeSrc  = 0                 # Sum of the sizes of departing, for windows that have passed
+		self.estSize     = 0                 # Sum of the sizes of all one-way trip sets so far
+
+	def detect(self, ids):
+		# Add the detections of a batch of travelers to the current epoch
+		if self.config.USE_SETS:
+			self.current.update(ids)
+		else:
+			self.current.add_many(ids)
+
+	def close(self, detections = None):
+		# Close the current epoch, with the given detections instead of those collected by detect,
+		# and start the next one. Returns counts().
+		epochArr = self.epoch
+		if detections is None:
+			detections = self.current
+
+		for epochDep in self.departures.get(epochArr, []):
+			oneWay                   = self.open[epochDep].intersection(detections)
+			self.estSize             = self.estSize + setSize(oneWay)
+			self.departing[epochDep] = self.departing[epochDep].union(oneWay)
+			self.commuterSet         = self.commuterSet.union(oneWay)
+			if epochArr == self.lastArr[epochDep]:
+				self.estSizeSrc = self.estSizeSrc + setSize(self.departing.pop(epochDep))
+				del self.open[epochDep]
+
+		if self.lastArr.get(epochArr, epochArr) > epochArr:
+			self.open[epochArr]      = detections
+			self.departing[epochArr] = self.config.emptySet()
+
+		self.epoch   = self.epoch + 1
+		self.current = self.config.emptySet()
+		return self.counts()
+
+	def counts(self):
+		# The union of all single trips that arrived in a closed epoch, the sum of the sizes of the
+		# unions per departure epoch whose window has passed, and the sum of the sizes of all
+		# one-way trip sets, as returned by Counter.findAllSingleTrips
+		return self.commuterSet, self.estSizeSrc, self.estSize
+
+	def estimates(self):
+		# The running estimates of the number of single trips
+		return setSize(self.commuterSet), self.estSizeSrc, self.estSize
@@ -0,0 +1,105 @@
+import numpy
+
+class EpochPlan(object):
+
+	'''
+	The epoch windows of a configuration, computed once instead of calling expectedArrEpochs in
+	every loop. For every epoch, arrStart and arrStop hold its range of arrival epochs (empty for
+	epochs in which no trip departs). pairs lists every (departure, arrival) epoch pair that single
+	trips are counted over, ordered by departure epoch: the pairs departing in epoch e are
+	pairs[pairStart[e]:pairStart[e + 1]]. quads lists every (departure, arrival, return departure,
+	return arrival) combination of two-way trips, and is built when it is first used.
+	'''
+
+	plans = {} # Plans by the parameters they depend on
+
+	def __init__(self, config):
+		numEpochs       = config.numEpochs()
+		self.numEpochs  = numEpochs
+		self.departures = config.departureEpochs()
+		self.lastDepRet = config.epoch(config.LASTDEP_RET) # First epoch in which a return trip can no longer depart
+
+		self.windows  = [range(0)] * numEpochs
+		self.arrStart = numpy.zeros(numEpochs, dtype = numpy.int32)
+		self.arrStop  = numpy.zeros(numEpochs, dtype = numpy.int32)
+		for epochDep in self.departures:
+			window                   = config.expectedArrEpochs(epochDep)
+			self.windows[epochDep]   = window
+			self.arrStart[epochDep]  = window.start
+			self.arrStop[epochDep]   = max(window.start, window.stop)
+
+		counts         = self.arrStop - self.arrStart
+		self.pairStart = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.int64)
+		dep            = numpy.repeat(numpy.arange(numEpochs, dtype = numpy.int32), counts)
+		arr            = self.arrStart[dep] + (numpy.arange(len(dep)) - self.pairStart[dep]).astype(numpy.int32)
+		self.pairs     = numpy.stack((dep, arr), axis = 1)
+		self._quads    = None
+
+	@classmethod
+	def forConfig(cls, config):
+		# The plan of config, shared by all configurations with the same epochs and trip times
+		key = (config.EPOCH_LENGTH, config.START_OF_DAY, config.END_OF_DAY, config.LASTDEP_RET,
+					 config.MIN_TRIPTIME, config.MAX_TRIPTIME, config.STD_TRIPTIME)
+		plan = cls.plans.get(key)
+		if plan is None:
+			plan = cls.plans[key] = cls(config)
+		return plan
+
+	def arrEpochs(self, epochDep):
+		# The range of arrival epochs of a departure epoch, as config.expectedArrEpochs
+		return self.windows[epochDep]
+
+	def pairsFrom(self, epochDep):
+		# The (departure, arrival) pairs departing in epochDep
+		return self.pairs[self.pairStart[epochDep]:self.pairStart[epochDep + 1]]
+
+	def returnRange(self, epochArr):
+		# The index range in pairs of the return trips that can follow an arrival in epochArr: those
+		# departing after it (a return trip never starts in the same epoch as its arrival), before
+		# lastDepRet
+		stop = self.pairStart[max(self.lastDepRet, 0)]
+		return min(self.pairStart[min(epochArr + 1, self.lastDepRet)], stop), stop
+
+	def returnPairs(self, epochArr):
+		# The (departure, arrival) pairs of the return trips that can follow an arrival in epochArr
+		start, stop = self.returnRange(epochArr)
+		return self.pairs[start:stop]
+
+	@property
+	def quads(self):
+		# All (departure, arrival, return departure, return arrival) epochs of two-way trips, ordered
+		# by outward pair
+		if self._quads is None:
+			start, stop = self.returnRanges()
+			counts      = stop - start
+			offsets     = numpy.concatenate(([0], numpy.cumsum(counts)))
+			outward     = numpy.repeat(numpy.arange(len(self.pairs)), counts)
+			returns     = start[outward] + numpy.arange(offsets[-1]) - offsets[outward]
+			self._quads = numpy.concatenate((self.pairs[outward], self.pairs[returns]), axis = 1)
+		return self._quads
+
+	def returnRanges(self):
+		# returnRange for the arrival epoch of every pair, as two arrays
+		stop  = self.pairStart[max(self.lastDepRet, 0)]
+		start = numpy.minimum(self.pairStart[numpy.minimum(self.pairs[:, 1] + 1, self.lastDepRet)], stop)
+		return start, numpy.full(len(self.pairs), stop)
+
+	def cost(self, commuters = False):
+		# The number of intersections per epoch that counting single trips (or commuters) evaluates
+		# for trips departing in that epoch
+		if not commuters:
+			return self.arrStop - self.arrStart
+		start, stop = self.returnRanges()
+		return numpy.bincount(self.pairs[:, 0], weights = 1 + stop - start, minlength = self.numEpochs)
+
+	def chunks(self, numChunks, commuters = False):
+		# Deal the departure epochs out over numChunks lists with about the same cost each, the most
+		# expensive epochs first
+		cost   = self.cost(commuters)
+		chunks = [[] for c in range(numChunks)]
+		loads  = numpy.zeros(numChunks)
+		for epochDep in sorted(self.departures, key = lambda epoch: -cost[epoch]):
+			c = int(numpy.argmin(loads))
+			chunks[c].append(epochDep)
+			loads[c] = loads[c] + cost[epochDep]
+		return [sorted(chunk) for chunk in chunks]
@@ -0,0 +1,199 @@
+# Sizing of the Bloom filters without sweeping: an analytic model predicts the fill of the
+# filters and the counting error for a given (m, k), recommend() finds the smallest m (and its
+# best k) that reaches a target accuracy, and validate() checks a prediction with a quick
+# simulation on vectorized synthetic trips.
+#
+# The model, for filters of m bits and k hash functions: a filter holding n items has a fraction
+# f(n) = 1 - exp(-k*n/m) of its bits set, and estimates n with a standard deviation of about
+# sqrt(m*(exp(k*n/m) - 1 - k*n/m))/k. The expected numbers of trips between every two epochs
+# follow the trip model: uniform departure minutes and uniform trip times.
+#
+# - The union of all intersections (completeSetSize) holds every traveler, and hardly any other
+#   bits: a bit that is set in two epoch filters by different travelers belongs to a traveler
+#   of the union anyway. Its error is the standard deviation of the estimate at fill f(NUM_TRIPS).
+# - The intersection of departure epoch d and arrival epoch a holds the c(d, a) trips between
+#   them, and the bits that the other items of both epochs happen to share, a fraction
+#   q(d, a) = f(n_d - c(d, a)) * f(n_a - c(d, a)). Its estimate is summed in estSizeFine.
+# - The union of the intersections of departure epoch d (summed in estSizeMid) holds the trips
+#   departing in d, and the shared bits of the items of d that did not depart then.
+#
+# The estimates of the intersections are small numbers that are truncated to integers, so their
+# expectation is taken over the (Poisson) number of bits that are set.
+#
+#   python -m travelers.planner --trips 100000 --epoch 5 --accuracy 0.99 --validate
+import argparse
+import copy
+import math
+import numpy
+from travelers.config import SimulationConfig, accuracy
+from travelers.detections import DetectionStore
+from travelers.counter import Counter
+from travelers.trips import Trips
+
+def tripsPerEpochPair(config):
+	# The expected number of trips departing in epoch d and arriving in epoch a, as a numEpochs x
+	# numEpochs array. Return trips depart uniformly after the average arrival of the outward trips.
+	numEpochs  = config.numEpochs()
+	minutes    = numpy.arange(config.END_OF_DAY)
+	departures = numpy.zeros(config.END_OF_DAY)
+	departures[config.START_OF_DAY:config.LASTDEP_OUT + 1] = config.NUM_TRIPS / (config.LASTDEP_OUT - config.START_OF_DAY + 1)
+	firstReturn = config.START_OF_DAY + (config.MIN_TRIPTIME + config.MAX_TRIPTIME) // 2
+	if config.PROB_RETURN > 0 and config.LASTDEP_RET >= firstReturn:
+		departures[firstReturn:config.LASTDEP_RET + 1] += config.NUM_TRIPS * config.PROB_RETURN / (config.LASTDEP_RET - firstReturn + 1)
+
+	trips    = numpy.zeros((numEpochs + 1, numEpochs + 1))
+	tripTime = numpy.arange(config.MIN_TRIPTIME, config.MAX_TRIPTIME + 1)
+	for minutesTravelled in tripTime:
+		arrival = numpy.minimum((minutes + minutesTravelled) // config.EPOCH_LENGTH, numEpochs)
+		numpy.add.at(trips, (minutes // config.EPOCH_LENGTH, arrival), departures / len(tripTime))
+	return trips[:numEpochs, :numEpochs]
+
+def epochPairs(config):
+	# The (departure, arrival) epoch pairs that findAllSingleTrips intersects
+	pairs = config.plan().pairs
+	return pairs[:, 0], pairs[:, 1]
+
+def expectedEstimate(size, hash_count, items, shared):
+	# The expected value of BloomFilter.sizeFromOnes for filters holding the given numbers of items
+	# (an array) plus a fraction shared of other bits. Small estimates are averaged over Poisson
+	# numbers of items and of other bits, as their truncation matters. Large ones are exact for
+	# the items, and lose (k - 1)/2k on average when other bits are set.
+	count    = numpy.arange(64)
+	lnFact   = numpy.concatenate(([0], numpy.cumsum(numpy.log(count[1:]))))
+	poisson  = lambda mean: numpy.exp(count * numpy.log(numpy.maximum(mean[:, None], 1e-300)) - mean[:, None] - lnFact)
+	estimate = lambda t: numpy.floor(-(size / hash_count) * numpy.log1p(-numpy.minimum(t, size - 1) / size))
+	fill     = numpy.minimum(1 - numpy.exp(-hash_count * items / size) * (1 - shared), 1 - 1 / size) # At most all bits but one
+	result   = numpy.maximum(-(size / hash_count) * numpy.log1p(-fill) + (1 - hash_count) / (2 * hash_count) * -numpy.expm1(-size * shared), 0)
+	small    = size * fill < 20
+	table    = estimate(hash_count * count[:, None] + count[None, :]) # (items, other bits)
+	result[small] = numpy.einsum("pi,pj,ij->p", poisson(items[small]), poisson(size * shared[small]), table)
+	return result
+
+def predict(config, size, hash_count):
+	# Predict the fills, the three estimates of the number of single trips of an experiment, and
+	# their accuracies, for filters of size bits and hash_count hash functions
+	m, k       = float(size), float(hash_count)
+	fill       = lambda n: -numpy.expm1(-k * numpy.maximum(n, 0) / m)
+	trips      = tripsPerEpochPair(config)
+	departures = trips.sum(axis = 1)
+	arrivals   = trips.sum(axis = 0)
+	items      = departures + arrivals
+	dep, arr   = epochPairs(config)
+	pairTrips  = trips[dep, arr]
+
+	# completeSetSize
+	occupancy = k * config.NUM_TRIPS / m
+	deviation = math.sqrt(m * (math.expm1(occupancy) - occupancy)) / k if occupancy < 700 else math.inf
+
+	# estSizeFine: every intersection on its own
+	shared      = fill(items[dep] - pairTrips) * fill(items[arr] - pairTrips)
+	fillPair    = 1 - (1 - fill(pairTrips)) * (1 - shared)
+	estSizeFine = expectedEstimate(m, k, pairTrips, shared).sum()
+
+	# estSizeMid: the union of the intersections of every departure epoch
+	epochs      = config.departureEpochs()
+	notShared   = numpy.ones(config.numEpochs())
+	numpy.multiply.at(notShared, dep, 1 - fill(arrivals[dep]) * fill(items[arr] - pairTrips))
+	estSizeMid  = expectedEstimate(m, k, departures[epochs.start:epochs.stop], 1 - notShared[epochs.start:epochs.stop]).sum()
+
+	return {"size":              size,
+					"hash_count":        hash_count,
+					"items_per_epoch":   float(items.max()),
+					"fill_epoch":        float(fill(items).max()),
+					"fill_intersection": float(fillPair.max()),
+					"fill_union":        float(fill(config.NUM_TRIPS)),
+					"completeSetSize":   config.NUM_TRIPS,
+					"estSizeMid":        float(estSizeMid),
+					"estSizeFine":       float(estSizeFine),
+					"accuracy":          max(1 - math.sqrt(2 / math.pi) * deviation / config.NUM_TRIPS, 0), # Expected, of completeSetSize
+					"accuracyMid":       accuracy(config.NUM_TRIPS, estSizeMid),
+					"accuracyFine":      accuracy(config.NUM_TRIPS, estSizeFine)}
+
+def reaches(prediction, target, metrics):
+	# Whether all given accuracies of a prediction reach the target
+	return all(prediction[metric] >= target for metric in metrics)
+
+def smallestSize(config, hash_count, target, metrics, maxSize = 1 << 40):
+	# The smallest size that reaches the target accuracies with hash_count hash functions, or None.
+	# The errors only decrease with the size, so a doubling and a binary search suffice.
+	high = 64
+	while not reaches(predict(config, high, hash_count), target, metrics):
+		high = high * 2
+		if high > maxSize:
+			return None
+	low = high // 2
+	while high - low > max(1, low // 1000):
+		mid = (low + high) // 2
+		if reaches(predict(config, mid, hash_count), target, metrics):
+			high = mid
+		else:
+			low = mid
+	return high
+
+def defaultMetrics(config):
+	# The accuracies to reach: those of completeSetSize, estSizeMid and estSizeFine, or only that
+	# of completeSetSize if there are return trips, which the other two count as well
+	return ("accuracy",) if config.PROB_RETURN > 0 else ("accuracy", "accuracyMid", "accuracyFine")
+
+def recommend(config, target = 0.99, metrics = None, maxHashCount = 16):
+	# Return the prediction for the smallest filters (m, k) whose predicted accuracies reach
+	# target (by default the defaultMetrics)
+	metrics = metrics or defaultMetrics(config)
+	best = None
+	for hash_count in range(1, maxHashCount + 1):
+		size = smallestSize(config, hash_count, target, metrics)
+		if size is not None and (best is None or size < best[0]):
+			best = (size, hash_count)
+	assert(best is not None), "target accuracy cannot be reached"
+	return predict(config, *best)
+
+def bestHashCount(config, size, metrics = None, maxHashCount = 16):
+	# The number of hash functions whose lowest predicted accuracy (of the defaultMetrics) is the
+	# highest, for filters of size bits
+	metrics = metrics or defaultMetrics(config)
+	return max(range(1, maxHashCount + 1),
+						 key = lambda hash_count: min(predict(config, size, hash_count)[metric] for metric in metrics))
+
+def validate(config, size, hash_count, runs = 3):
+	# Count single trips with filters of size bits and hash_count hash functions on runs sets of
+	# vectorized synthetic trips, and return the measured fill and accuracy next to the prediction
+	measured = []
+	for seed in range(runs):
+		run = copy.copy(config)
+		run.BF_SIZE, run.BF_HASH_COUNT, run.USE_SETS, run.USE_SKETCH = size, hash_count, False, False
+		run.VECTORIZED, run.SEED, run.WORKERS = True, seed, 1
+		store = DetectionStore(run)
+		store.store(Trips.generate(run))
+		completeSet, estSizeMid, estSizeFine = Counter(run, store.tripSet).findAllSingleTrips()
+		measured.append((completeSet.estimatedSize(), estSizeMid, estSizeFine, completeSet.ls()[3]))
+	measured = numpy.array(measured, dtype = float)
+	return {"predicted": predict(config, size, hash_count),
+					"measured":  {"completeSetSize": measured[:, 0].mean(), "estSizeMid": measured[:, 1].mean(),
+												"estSizeFine": measured[:, 2].mean(), "fill_union": measured[:, 3].mean(),
+												"accuracy": numpy.mean([accuracy(config.NUM_TRIPS, n) for n in measured[:, 0]]),
+												"accuracyMid": numpy.mean([accuracy(config.NUM_TRIPS, n) for n in measured[:, 1]]),
+												"accuracyFine": numpy.mean([accuracy(config.NUM_TRIPS, n) for n in measured[:, 2]])}}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Predict Bloom filter sizes for counting single trips")
+	parser.add_argument("--trips", type = int, default = 1000, help = "NUM_TRIPS")
+	parser.add_argument("--locations", type = int, default = 2, help = "NUM_LOCATIONS")
+	parser.add_argument("--epoch", type = int, default = 5, help = "EPOCH_LENGTH (minutes)")
+	parser.add_argument("--return", dest = "prob_return", type = float, default = 0, help = "PROB_RETURN")
+	parser.add_argument("--accuracy", type = float, default = 0.99, help = "Target accuracy")
+	parser.add_argument("--size", type = int, help = "Predict for this m instead of recommending one")
+	parser.add_argument("--hashes", type = int, help = "Predict for this k (with --size; by default the best k for it)")
+	parser.add_argument("--validate", type = int, nargs = "?", const = 3, default = 0, help = "Check with this many simulations")
+	args = parser.parse_args()
+
+	config = SimulationConfig(NUM_LOCATIONS = args.locations, NUM_TRIPS = args.trips, EPOCH_LENGTH = args.epoch,
+														PROB_RETURN = args.prob_return)
+	if args.size:
+		plan = predict(config, args.size, args.hashes or bestHashCount(config, args.size))
+	else:
+		plan = recommend(config, args.accuracy)
+	for key, value in plan.items():
+		print("{:18s} {}".format(key, value))
+	if args.validate:
+		for key, value in validate(config, plan["size"], plan["hash_count"], args.validate)["measured"].items():
+			print("measured {:9s} {}".format(key, float(value)))
@@ -0,0 +1,170 @@
+# Counting over several days. A RollingStore keeps the per-epoch Bloom filters of the last few days
+# in a ring buffer that is allocated once, and numbers the epochs on one timeline over all days, so
+# that trips crossing midnight arrive in the epochs of the next day. As soon as the arrival window
+# of a departure epoch is complete, its single trips are counted and ORed into a summary of its day.
+# Counts over a week then OR seven daily summaries instead of intersecting every epoch again, so the
+# ring only needs to hold the days whose departures are still being counted.
+#
+#   python -m travelers.rolling --days 7 --trips 10000
+import argparse
+import os
+from collections import OrderedDict
+import numpy
+from bloomfilter import BloomFilterMatrix, popcount
+from travelers.config import SimulationConfig
+from travelers.detections import DetectionStore
+from travelers.trips import Trips
+
+class RollingStore(object):
+
+	'''
+	Per-epoch detections (over all locations) of the last days, in a ring buffer of Bloom filter
+	words. Epoch t of the timeline is epoch t % numEpochs() of day t // numEpochs(). When a new day
+	starts, the epochs of the oldest day in the ring are evicted: written to the directory, if one
+	is given, or dropped. The summaries of the last summaryDays days are kept: per day, the union
+	of its single trips and the sums of the sizes of its departure unions and of its one-way trip
+	sets (as completeSetSize, estSizeMid and estSizeFine of findAllSingleTrips).
+	'''
+
+	def __init__(self, config, days = 2, summaryDays = 7, directory = None):
+		assert(days >= 2 and not config.USE_SETS and not config.USE_SKETCH)
+		self.config      = config
+		self.days        = days
+		self.summaryDays = summaryDays
+		self.directory   = directory
+		self.template    = config.emptySet()
+		self.perDay      = config.numEpochs()
+		self.departures  = config.departureEpochs() # Epochs of a day in which trips depart
+		self.ring        = numpy.zeros((days * self.perDay, (self.template.size + 63) // 64), dtype = numpy.uint64)
+
+		# The arrival window as offsets from the departure epoch. expectedArrEpochs cuts it off at
+		# the end of the day; here it continues into the next day.
+		firstDep      = config.departureEpochs().start
+		window        = config.expectedArrEpochs(firstDep)
+		self.arrFirst = window.start - firstDep
+		self.arrStop  = max(window.stop - firstDep, self.arrFirst)
+
+		self.epochs    = 0             # Epochs added so far; the next one is epoch self.epochs of the timeline
+		self.counted   = 0             # Departure epochs counted so far
+		self.summaries = OrderedDict() # day -> [union words, estSizeMid, estSizeFine], for the last days
+
+		if directory is not None:
+			os.makedirs(directory, exist_ok = True)
+
+	def add(self, detections):
+		# Add the detections of the next epoch (a BloomFilter, or its words), and count the
+		# departure epochs whose arrival window has now been added
+		words = detections.words() if hasattr(detections, 'words') else detections
+		epoch = self.epochs
+		if epoch % self.perDay == 0 and epoch >= len(self.ring):
+			self.evict(epoch // self.perDay - self.days)
+		self.ring[epoch % len(self.ring)] = words
+		self.epochs = epoch + 1
+		while self.counted + max(self.arrStop, 1) <= self.epochs:
+			self.countDeparture(self.counted)
+			self.counted = self.counted + 1
+
+	def addDay(self, tripSet):
+		# Add all epochs of a day, such as DetectionStore.tripSet
+		assert(self.epochs % self.perDay == 0 and len(tripSet) == self.perDay)
+		for detections in tripSet:
+			self.add(detections)
+
+	def finish(self):
+		# Count the last departures of the last day, by adding empty epochs for the arrivals after
+		# midnight. No more detections can be added after this.
+		lastDeparture = -(-self.epochs // self.perDay) * self.perDay # End of the last day that was started
+		while self.counted < lastDeparture:
+			self.add(numpy.zeros(self.ring.shape[1], dtype = numpy.uint64))
+
+	def countDeparture(self, epochDep):
+		# Count the single trips of an epoch of the timeline, if trips depart in it, and add them to
+		# the summary of its day
+		day = epochDep // self.perDay
+		if day not in self.summaries:
+			self.summaries[day] = [numpy.zeros(self.ring.shape[1], dtype = numpy.uint64), 0, 0]
+			while len(self.summaries) > self.summaryDays:
+				self.summaries.popitem(last = False)
+		if epochDep % self.perDay not in self.departures:
+			return
+		departures = self.ring[epochDep % len(self.ring)]
+		if not departures.any():
+			return
+		arrivals  = numpy.arange(epochDep + self.arrFirst, epochDep + self.arrStop) % len(self.ring)
+		trips     = self.ring[arrivals] & departures # One-way trips per arrival epoch
+		departing = numpy.bitwise_or.reduce(trips, axis = 0)
+		summary   = self.summaries[day]
+		summary[0] |= departing
+		summary[1] = summary[1] + self.template.sizeFromOnes(int(popcount(departing)))
+		summary[2] = summary[2] + sum(self.template.sizeFromOnes(t) for t in popcount(trips).tolist())
+
+	def evict(self, day):
+		# Drop the epochs of a day from the ring, after writing them to the directory if there is one
+		if self.directory is None:
+			return
+		start  = (day * self.perDay) % len(self.ring)
+		matrix = BloomFilterMatrix(1, self.perDay, fixed_size = self.template.size,
+															 fixed_hash_count = self.template.hash_count, hashing = self.template.hashing)
+		matrix.bits[:]      = self.ring[start:start + self.perDay]
+		matrix.epoch_length = self.config.EPOCH_LENGTH
+		matrix.save(self.fileName(day))
+
+	def fileName(self, day):
+		# The file that the epochs of an evicted day are written to
+		return os.path.join(self.directory, "day-{:05d}.bfg".format(day))
+
+	def loadDay(self, day):
+		# The epochs of an evicted day, memory-mapped as a 1 x numEpochs() BloomFilterMatrix
+		return BloomFilterMatrix.load(self.fileName(day))
+
+	def completeDays(self):
+		# The days in the summaries whose departures have all been counted
+		return [day for day in self.summaries if (day + 1) * self.perDay <= self.counted]
+
+	def count(self, days = 7):
+		# The single trips of the last days complete days: the union of their summaries as a
+		# BloomFilter, and the sums of their estSizeMid and estSizeFine. The union saturates unless
+		# the filters are sized for the trips of all these days together.
+		complete = self.completeDays()[-days:]
+		union    = numpy.zeros(self.ring.shape[1], dtype = numpy.uint64)
+		for day in complete:
+			union |= self.summaries[day][0]
+		return (self.template.fromWords(union, self.template.size, self.template.hash_count, self.template.hashing),
+						sum(self.summaries[day][1] for day in complete), sum(self.summaries[day][2] for day in complete))
+
+	def dayCount(self, day):
+		# The summary of one day as (union BloomFilter, estSizeMid, estSizeFine)
+		words, estSizeMid, estSizeFine = self.summaries[day]
+		return self.template.fromWords(words, self.template.size, self.template.hash_count, self.template.hashing), \
+					 estSizeMid, estSizeFine
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Count single trips over several simulated days")
+	parser.add_argument("--days", type = int, default = 7, help = "Number of days to simulate and count")
+	parser.add_argument("--ring", type = int, default = 2, help = "Days of epoch filters kept in memory")
+	parser.add_argument("--directory", help = "Write evicted days here")
+	parser.add_argument("--locations", type = int, default = 2, help = "NUM_LOCATIONS")
+	parser.add_argument("--trips", type = int, default = 1000, help = "NUM_TRIPS per day")
+	parser.add_argument("--epoch", type = int, default = 5, help = "EPOCH_LENGTH (minutes)")
+	parser.add_argument("--size", type = int, default = 0, help = "BF_SIZE (with --hashes), sized for the union of all days")
+	parser.add_argument("--hashes", type = int, default = 0, help = "BF_HASH_COUNT")
+	args = parser.parse_args()
+
+	# The filters are sized for the union of all days, which count ORs together
+	store = None
+	for day in range(args.days):
+		config = SimulationConfig(NUM_LOCATIONS = args.locations, NUM_TRIPS = args.trips, EPOCH_LENGTH = args.epoch,
+															MAX_DETECTIONS = args.trips * args.days, SEED = day, VECTORIZED = True,
+															BF_SIZE = args.size, BF_HASH_COUNT = args.hashes)
+		store = store or RollingStore(config, args.ring, args.days, args.directory)
+		detections = DetectionStore(config)
+		detections.store(Trips.generate(config))
+		store.addDay(detections.tripSet)
+		if day > 0:
+			completeSet, estSizeMid, estSizeFine = store.dayCount(day - 1)
+			print("day", day - 1, completeSet.estimatedSize(), estSizeMid, estSizeFine)
+	store.finish()
+	completeSet, estSizeMid, estSizeFine = store.dayCount(args.days - 1)
+	print("day", args.days - 1, completeSet.estimatedSize(), estSizeMid, estSizeFine)
+	completeSet, estSizeMid, estSizeFine = store.count(args.days)
+	print("all", completeSet.estimatedSize(), estSizeMid, estSizeFine)
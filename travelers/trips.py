@@ -0,0 +1,172 @@
+import os
+import pickle
+import random
+import numpy
+from travelers.network import Network, SRC, DST, AVG, STD
+
+TID = 0 # Index of traveler ID in a trip
+LNK = 1 # Index of link in a trip
+DEP = 2 # Index of departure time in a trip
+ARR = 3 # Index of arrival time in a trip
+
+# A trip of a traveler from src to dst, with departure and arrival times in minutes
+TRIP_DTYPE  = numpy.dtype([("traveler", numpy.int64), ("src", numpy.int32), ("dst", numpy.int32),
+													 ("dep", numpy.int32), ("arr", numpy.int32)])
+# The same trip, with departure and arrival epochs
+EPOCH_DTYPE = numpy.dtype([("traveler", numpy.int64), ("src", numpy.int32), ("dst", numpy.int32),
+													 ("dep_epoch", numpy.int32), ("arr_epoch", numpy.int32)])
+
+class Trips(object):
+
+	'''
+	A generated network with the trips made on it. Trip times are kept in minutes, so one set
+	of trips can be counted with any epoch length or filter setting.
+	'''
+
+	def __init__(self, network, trips, numOfReturners):
+		self.network        = network
+		self.trips          = trips          # Structured array of TRIP_DTYPE
+		self.numOfReturners = numOfReturners # Ground truth when it comes to returners
+
+	@classmethod
+	def generate(cls, config):
+		# Generate a network (or load it from config.NETWORK) and the trips on it. A loaded network
+		# is made undirected, as the trip model needs a link back for every return trip.
+		if config.VECTORIZED:
+			rng     = numpy.random.default_rng(config.SEED)
+			if config.NETWORK:
+				network = Network.load(config, config.NETWORK, undirected = True)
+			else:
+				network = Network.generateVectorized(config, rng)
+			trips   = cls.drawVectorized(config, network, rng)
+		else:
+			if config.NETWORK:
+				network = Network.load(config, config.NETWORK, undirected = True)
+			else:
+				network = Network.generate(config)
+			trips   = cls.draw(config, network)
+		print("Trips generated")
+		return trips
+
+	def epochs(self, config):
+		# Return the trips with departure and arrival epochs instead of times
+		tripEpochs              = numpy.empty(len(self.trips), dtype = EPOCH_DTYPE)
+		tripEpochs["traveler"]  = self.trips["traveler"]
+		tripEpochs["src"]       = self.trips["src"]
+		tripEpochs["dst"]       = self.trips["dst"]
+		tripEpochs["dep_epoch"] = epochOf(config, self.trips["dep"])
+		tripEpochs["arr_epoch"] = epochOf(config, self.trips["arr"])
+		return tripEpochs
+
+	@classmethod
+	def draw(cls, config, network):
+		# Given the number of required trips, we construct a trip from a randomly chosen node to one
+		# of its neighbors, and with PROB_RETURN probability, also a return trip. All trips get a
+		# guaranteed unique ID.
+		epoch          = config.epoch
+		numOfReturners = 0
+		travelerIDSet  = random.sample(range(config.MAX_TRAVELERS), config.NUM_TRIPS)
+		tripsRaw       = []
+
+		# Generate random trips from one location to another
+		for trip in range(1, config.NUM_TRIPS):
+			travelerID		 = travelerIDSet[trip]
+			outwardSrc		 = random.randint(0, config.NUM_LOCATIONS - 1)
+			outwardLink		 = random.sample(network.outLinks[outwardSrc], k = 1)[0]
+			depTimeOutward = random.randint(config.START_OF_DAY, config.LASTDEP_OUT)
+			arrTimeOutward = depTimeOutward + round(numpy.random.normal(outwardLink[AVG], outwardLink[STD]))
+
+			assert(epoch(depTimeOutward) <= epoch(arrTimeOutward))
+			tripsRaw.append((travelerID, outwardLink, depTimeOutward, arrTimeOutward))
+
+			# Check if this traveler is going back
+			if random.random() < config.PROB_RETURN and arrTimeOutward < config.LASTDEP_RET:
+				returnSrc	    = outwardLink[DST]
+				returnLink    = network.findLink(returnSrc, outwardSrc)
+				depTimeReturn = random.randint(arrTimeOutward, config.LASTDEP_RET)
+				arrTimeReturn = depTimeReturn + round(numpy.random.normal(returnLink[AVG], returnLink[STD]))
+
+				assert(epoch(depTimeReturn) <= epoch(arrTimeReturn))
+				tripsRaw.append((travelerID, returnLink, depTimeReturn, arrTimeReturn))
+				numOfReturners = numOfReturners + 1
+
+		trips = numpy.array([(trip[TID], trip[LNK][SRC], trip[LNK][DST], trip[DEP], trip[ARR]) for trip in tripsRaw],
+												dtype = TRIP_DTYPE)
+		return cls(network, trips, numOfReturners)
+
+	@classmethod
+	def drawVectorized(cls, config, network, rng):
+		# The same trip model as draw, with all trips drawn at once as arrays from the NumPy generator
+		# rng. Links are sampled from the compressed sparse rows of the network.
+		indptr, linkDst, linkAvg, linkStd = network.csr()
+		numTrips = config.NUM_TRIPS - 1 # Like draw, which skips the first traveler ID
+
+		# Every location can be drawn as a source, so each one needs a link to leave by
+		isolated = numpy.flatnonzero(numpy.diff(indptr) == 0)
+		if len(isolated):
+			raise ValueError("Location {} has no outgoing links to draw trips from".format(int(isolated[0])))
+
+		travelers   = rng.choice(config.MAX_TRAVELERS, config.NUM_TRIPS, replace = False)[1:]
+		outwardSrc  = rng.integers(0, config.NUM_LOCATIONS, numTrips)
+		degree      = indptr[outwardSrc + 1] - indptr[outwardSrc]
+		outwardLink = indptr[outwardSrc] + (rng.random(numTrips) * degree).astype(numpy.int64)
+		depOutward  = rng.integers(config.START_OF_DAY, config.LASTDEP_OUT + 1, numTrips)
+		arrOutward  = depOutward + tripTimes(rng, linkAvg[outwardLink], linkStd[outwardLink])
+
+		# Travelers going back take the link in the opposite direction, found by looking up the key
+		# src * NUM_LOCATIONS + dst among the (sorted) keys of all links
+		returning  = (rng.random(numTrips) < config.PROB_RETURN) & (arrOutward < config.LASTDEP_RET)
+		linkSrc    = numpy.repeat(numpy.arange(config.NUM_LOCATIONS), numpy.diff(indptr))
+		linkKeys   = linkSrc * config.NUM_LOCATIONS + linkDst
+		returnSrc  = linkDst[outwardLink[returning]]
+		returnLink = numpy.searchsorted(linkKeys, returnSrc * config.NUM_LOCATIONS + outwardSrc[returning])
+		depReturn  = rng.integers(arrOutward[returning], config.LASTDEP_RET + 1)
+		arrReturn  = depReturn + tripTimes(rng, linkAvg[returnLink], linkStd[returnLink])
+
+		numReturns = len(returnLink)
+		trips = numpy.empty(numTrips + numReturns, dtype = TRIP_DTYPE)
+		trips["traveler"] = numpy.concatenate((travelers, travelers[returning]))
+		trips["src"]      = numpy.concatenate((outwardSrc, returnSrc))
+		trips["dst"]      = numpy.concatenate((linkDst[outwardLink], outwardSrc[returning]))
+		trips["dep"]      = numpy.concatenate((depOutward, depReturn))
+		trips["arr"]      = numpy.concatenate((arrOutward, arrReturn))
+		return cls(network, trips, numReturns)
+
+	def save(self, config, fileName):
+		# Store the network and the raw trips, so that runs with other epoch or filter settings can reuse
+		# them. The file is written under a temporary name first, as concurrent runs may read it.
+		generated = {"key": config.generationKey(), "outLinks": self.network.outLinks,
+								 "trips": self.trips, "numOfReturners": self.numOfReturners}
+		with open(fileName + ".tmp" + str(os.getpid()), "wb") as f:
+			pickle.dump(generated, f)
+		os.replace(fileName + ".tmp" + str(os.getpid()), fileName)
+
+	@classmethod
+	def load(cls, config, fileName):
+		# Load the network and raw trips stored by save
+		with open(fileName, "rb") as f:
+			generated = pickle.load(f)
+		assert(generated["key"] == config.generationKey())
+		network          = Network(config.NUM_LOCATIONS)
+		network.outLinks = generated["outLinks"]
+		print("Network and trips loaded from", fileName)
+		return cls(network, generated["trips"], generated["numOfReturners"])
+
+	@classmethod
+	def obtain(cls, config, fileName = None):
+		# Load the trips from fileName if it exists, otherwise generate them (and store them in fileName)
+		if fileName is not None and os.path.exists(fileName):
+			return cls.load(config, fileName)
+		trips = cls.generate(config)
+		if fileName is not None:
+			trips.save(config, fileName)
+		return trips
+
+def epochOf(config, times):
+	# Vectorized config.epoch
+	return (numpy.asarray(times) / config.EPOCH_LENGTH).astype(numpy.int64)
+
+def tripTimes(rng, avg, std):
+	# Trip times in whole minutes, drawn from normal distributions. The rare negative draws of
+	# links with a large deviation are clamped to 0, so that no trip arrives before it departs.
+	return numpy.maximum(numpy.rint(rng.normal(avg, std)), 0).astype(numpy.int64)
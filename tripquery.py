@@ -0,0 +1,231 @@
+# Query engine for counting one-way and two-way trips from per-epoch detection sets.
+# Works on Python sets, Bloom filters and sketches.
+import sys
+from collections import OrderedDict
+import numpy
+from bloomfilter import popcount
+
+
+def setSize(tripSet):
+	'''
+	Return the (estimated) number of travelers in a set, Bloom filter or sketch
+	'''
+	if hasattr(tripSet, 'estimatedSize'):
+		return tripSet.estimatedSize()
+	return len(tripSet)
+
+def setBytes(tripSet):
+	'''
+	Return the approximate number of bytes taken by a set, Bloom filter or sketch
+	'''
+	if hasattr(tripSet, 'bit_array'):
+		return tripSet.bit_array.nbytes
+	if hasattr(tripSet, 'hashes'):
+		return tripSet.hashes.nbytes
+	if hasattr(tripSet, 'items') and hasattr(tripSet.items, 'nbytes'):
+		return tripSet.items.nbytes
+	return sys.getsizeof(tripSet) + 32 * len(tripSet)
+
+def intersectionSize(tripSetA, tripSetB):
+	'''
+	Return the (estimated) size of the intersection of two sets, Bloom filters or sketches
+	'''
+	if hasattr(tripSetA, 'estimatedIntersectionSize'):
+		return tripSetA.estimatedIntersectionSize(tripSetB)
+	return len(tripSetA & tripSetB)
+
+
+class SetCache(object):
+
+	'''
+	An LRU cache of sets, Bloom filters or sketches, bounded by the bytes they take rather
+	than by their number
+	'''
+
+	def __init__(self, budget):
+		self.budget = budget
+		self.items  = OrderedDict()
+		self.bytes  = 0
+
+	def __contains__(self, key):
+		return key in self.items
+
+	def __len__(self):
+		return len(self.items)
+
+	def get(self, key, default=None):
+		'''
+		Return the set cached under key, as the most recently used one, or default
+		'''
+		tripSet = self.items.get(key)
+		if tripSet is None:
+			return default
+		self.items.move_to_end(key)
+		return tripSet
+
+	def put(self, key, tripSet):
+		'''
+		Cache a set under key, evicting the least recently used ones while over the budget
+		'''
+		if key in self.items:
+			self.bytes = self.bytes - setBytes(self.items.pop(key))
+		self.items[key] = tripSet
+		self.bytes = self.bytes + setBytes(tripSet)
+		while self.bytes > self.budget and self.items:
+			key, evicted = self.items.popitem(last=False)
+			self.bytes = self.bytes - setBytes(evicted)
+
+
+class TripQueryEngine(object):
+
+	'''
+	Answers trip queries over a list of detections per epoch. For two-way searches,
+	one-way intersections are memoized per (departure, arrival) epoch pair, and the
+	return trips that can follow an arrival are kept as suffix unions over departure
+	epochs, so that they do not rebuild the same intersections and unions. Both are LRU
+	caches bounded in bytes. Single trips use every intersection once, and cache none.
+	The epoch windows come from a precomputed plan (travelers.plan.EpochPlan); with
+	Bloom filters, the sizes of two-way trips are computed for all return pairs of an
+	outward trip at once.
+	'''
+
+	def __init__(self, tripSet, plan, emptySet, cache_budget=1 << 27, memory_budget=1 << 28):
+		'''
+		tripSet : list
+			Detections (set or BloomFilter) per epoch
+		plan : EpochPlan
+			The arrival epochs of every departure epoch, and the flattened (departure,
+			arrival) epoch pairs
+		emptySet : function
+			Returns a new, empty set or Bloom filter
+		cache_budget : int
+			Bytes that the memoized one-way intersections may take, and as many for the
+			memoized unions of return trips
+		memory_budget : int
+			Bytes that the words of the one-way trips of return pairs may take (Bloom
+			filters). Within it, they are computed once for all pairs; otherwise in
+			chunks, for every outward trip.
+		'''
+		self.tripSet    = tripSet
+		self.plan       = plan
+		self.arrEpochs  = plan.arrEpochs
+		self.lastDepRet = plan.lastDepRet
+		self.emptySet   = emptySet
+		self.memory_budget = memory_budget
+
+		self.oneWayCache  = SetCache(cache_budget) # (epochDep, epochArr) -> one-way trips
+		self.returnsAfter = SetCache(cache_budget) # epochDep -> union of all one-way trips leaving at or after it
+		self.epochWords   = None          # Words of the detections per epoch (Bloom filters)
+		self.pairWords    = None          # Words of the one-way trips of all return pairs, if within memory_budget
+		self.hits   = 0
+		self.misses = 0
+
+	def oneWay(self, epochDep, epochArr):
+		'''
+		Return all trips departing at epochDep and arriving at epochArr
+		'''
+		key = (epochDep, epochArr)
+		trips = self.oneWayCache.get(key)
+		if trips is not None:
+			self.hits = self.hits + 1
+			return trips
+
+		self.misses = self.misses + 1
+		trips = self.tripSet[epochDep].intersection(self.tripSet[epochArr])
+		self.oneWayCache.put(key, trips)
+		return trips
+
+	def departing(self, epochDep):
+		'''
+		Return the union of all one-way trips departing at epochDep
+		'''
+		trips = self.emptySet()
+		for epochArr in self.arrEpochs(epochDep):
+			trips = trips.union(self.oneWay(epochDep, epochArr))
+		return trips
+
+	def returnTrips(self, epochDep):
+		'''
+		Return the union of all one-way trips departing from epochDep up to lastDepRet
+		'''
+		if epochDep >= self.lastDepRet:
+			return self.emptySet()
+		trips = self.returnsAfter.get(epochDep)
+		if trips is None:
+			# Extend the suffix unions down from the nearest later epoch that is still cached
+			e = epochDep + 1
+			while e < self.lastDepRet and e not in self.returnsAfter:
+				e = e + 1
+			trips = self.returnsAfter.get(e, self.emptySet())
+			for e in range(e - 1, epochDep - 1, -1):
+				trips = self.departing(e).union(trips)
+				self.returnsAfter.put(e, trips)
+		return trips
+
+	def singleTrips(self, epochDepSrc):
+		'''
+		Return the union of all single trips leaving during epochDepSrc, and the sum of
+		the sizes of the one-way trip sets making up that union
+		'''
+		singleSet = self.emptySet()
+		estSize   = 0
+		for epochArrDst in self.arrEpochs(epochDepSrc):
+			trips     = self.tripSet[epochDepSrc].intersection(self.tripSet[epochArrDst])
+			estSize   = estSize + setSize(trips)
+			singleSet = singleSet.union(trips)
+		return singleSet, estSize
+
+	def commuters(self, epochDepSrc):
+		'''
+		Return the union of all two-way trips leaving during epochDepSrc, and the sum of
+		the sizes of the individual two-way trip sets. The union of a one-way trip set with
+		all later return trips equals the union of the pairwise intersections, so only the
+		sizes require visiting every (outward, return) pair. This does not hold for sketches,
+		whose unions keep only the k smallest hash values, so their union is built from the
+		pairwise intersections as well.
+		'''
+		commuterSet = self.emptySet()
+		estSize     = 0
+		for epochArrDst in self.arrEpochs(epochDepSrc):
+			outwardTrips = self.oneWay(epochDepSrc, epochArrDst)
+			# Assume a return trip never starts in the same epoch as its arrival.
+			if not getattr(outwardTrips, 'distributive', True):
+				for epochDepDst, epochArrSrc in self.plan.returnPairs(epochArrDst).tolist():
+					trips       = outwardTrips.intersection(self.oneWay(epochDepDst, epochArrSrc))
+					estSize     = estSize + trips.estimatedSize()
+					commuterSet = commuterSet.union(trips)
+				continue
+			if hasattr(outwardTrips, 'words'):
+				estSize = estSize + self.returnSizes(outwardTrips, epochArrDst)
+			else:
+				for epochDepDst, epochArrSrc in self.plan.returnPairs(epochArrDst).tolist():
+					estSize = estSize + intersectionSize(outwardTrips, self.oneWay(epochDepDst, epochArrSrc))
+			commuterSet = commuterSet.union(outwardTrips.intersection(self.returnTrips(epochArrDst + 1)))
+		return commuterSet, estSize
+
+	def returnSizes(self, outwardTrips, epochArrDst):
+		'''
+		Return the sum of the estimated sizes of the intersections of a Bloom filter of
+		outward trips with the one-way trips of every return pair after epochArrDst
+		'''
+		if self.epochWords is None:
+			self.epochWords = numpy.array([trips.words() for trips in self.tripSet])
+			numPairs = self.plan.returnRange(-1)[1]
+			if numPairs * self.epochWords[0].nbytes <= self.memory_budget:
+				pairs = self.plan.pairs[:numPairs]
+				self.pairWords = self.epochWords[pairs[:, 0]] & self.epochWords[pairs[:, 1]]
+		# A chunk of pairs takes a few temporary arrays, together within the budget
+		chunk = max(1, self.memory_budget // (4 * self.epochWords[0].nbytes))
+		start, stop = self.plan.returnRange(epochArrDst)
+		estSize = 0
+		for first in range(start, stop, chunk):
+			last = min(first + chunk, stop)
+			if self.pairWords is not None:
+				trips = self.pairWords[first:last] & outwardTrips.words()
+			else:
+				pairs = self.plan.pairs[first:last]
+				trips = self.epochWords[pairs[:, 0]] & self.epochWords[pairs[:, 1]]
+				trips &= outwardTrips.words()
+			ones, counts = numpy.unique(popcount(trips), return_counts=True)
+			estSize = estSize + sum(outwardTrips.sizeFromOnes(t) * n for t, n in zip(ones.tolist(), counts.tolist()))
+		return estSize